@@ -0,0 +1,66 @@
+"""
+Benchmark the size of the ellipsoidal robust counterpart of a portfolio
+problem with `n` assets.
+
+The covariance matrix is either low rank (a factor model with `k` factors)
+or full rank. For each, the counterpart is built once with the quadratic
+form x^T * cov * x and once with the factored form ||L^T * x||^2, and the
+number of terms in the resulting constraints and the build time are
+reported.
+
+Usage:
+    python benchmarks/ellipsoidal_padding.py [n [k]]
+"""
+import sys
+import time
+import numpy as np
+import pyomo.environ as pe
+import romodel as ro
+from pyomo.repn import generate_standard_repn
+from romodel.reformulate import EllipsoidalTransformation
+
+
+def build_model(mean, cov):
+    n = len(mean)
+    m = pe.ConcreteModel()
+    m.x = pe.Var(range(n), bounds=(0, 1))
+    m.U = ro.uncset.EllipsoidalSet(mean, cov)
+    m.r = ro.UncParam(range(n), nominal=mean, uncset=m.U)
+    m.z = pe.Var()
+    m.budget = pe.Constraint(expr=pe.quicksum(m.x[i] for i in range(n)) == 1)
+    m.ret = pe.Constraint(expr=pe.sum_product(m.r, m.x) >= m.z)
+    m.obj = pe.Objective(expr=m.z, sense=pe.maximize)
+    return m
+
+
+def count_terms(m):
+    terms = 0
+    for c in m.component_data_objects(pe.Constraint, active=True):
+        repn = generate_standard_repn(c.body, compute_values=False)
+        terms += len(repn.linear_vars) + len(repn.quadratic_vars)
+    return terms
+
+
+def run(mean, cov, factor):
+    m = build_model(mean, cov)
+    start = time.time()
+    EllipsoidalTransformation().apply_to(m, factor=factor)
+    elapsed = time.time() - start
+    return count_terms(m), elapsed
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rng = np.random.RandomState(0)
+    mean = rng.uniform(0.01, 0.1, n).tolist()
+    B = rng.normal(0, 0.05, (n, k))
+    covs = {'low rank ({})'.format(k): B.dot(B.T),
+            'full rank': B.dot(B.T) + np.diag(rng.uniform(1e-4, 1e-3, n))}
+    print("{:>16} {:>8} {:>10} {:>10}".format('covariance', 'factor',
+                                              'terms', 'time [s]'))
+    for name, cov in covs.items():
+        for factor in (False, True):
+            terms, elapsed = run(mean, cov.tolist(), factor)
+            print("{:>16} {:>8} {:>10} {:>10.3f}".format(name, str(factor),
+                                                         terms, elapsed))
@@ -0,0 +1,49 @@
+"""
+Benchmark the time spent generating the representation of uncertain
+constraints with respect to their uncertain parameters.
+
+Each model has `n` variables and `n` uncertain constraints over a shared
+polyhedral uncertainty set. The time per constraint should stay roughly
+constant as the model grows.
+
+Usage:
+    python benchmarks/repn_scaling.py [n1 n2 ...]
+"""
+import sys
+import time
+import pyomo.environ as pe
+import romodel as ro
+from romodel.reformulate import PolyhedralTransformation
+
+
+def build_model(n, k=5):
+    m = pe.ConcreteModel()
+    m.x = pe.Var(range(n), bounds=(0, 1))
+    m.U = ro.uncset.PolyhedralSet([[1 if i == j else 0 for j in range(k)]
+                                   for i in range(k)],
+                                  [1]*k)
+    m.w = ro.UncParam(range(k), nominal=[0.5]*k, uncset=m.U)
+    m.cons = pe.ConstraintList()
+    for i in range(n):
+        m.cons.add(pe.quicksum(m.w[j]*m.x[(i + j) % n]
+                               for j in range(k)) <= 1)
+    return m
+
+
+def time_repn(n):
+    m = build_model(n)
+    t = PolyhedralTransformation()
+    t._instance = m
+    cons = list(t.get_uncertain_components(m))
+    start = time.time()
+    for c in cons:
+        t.generate_repn_param(c)
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [250, 500, 1000, 2000]
+    print("{:>8} {:>12} {:>16}".format('n', 'total [s]', 'per cons [ms]'))
+    for n in sizes:
+        total = time_repn(n)
+        print("{:>8} {:>12.3f} {:>16.3f}".format(n, total, 1000*total/n))
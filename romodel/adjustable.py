@@ -1,30 +1,25 @@
 from pyomo.core import Transformation, TransformationFactory
 from pyomo.core import Objective, Var, Constraint, quicksum, ConstraintList
 from pyomo.core.expr.visitor import replace_expressions
-from pyomo.repn import generate_standard_repn
 from pyomo.core.expr.numvalue import nonpyomo_leaf_types
 from pyomo.environ import inequality
+import time
 from itertools import chain
-from romodel.util import collect_adjustable
-from romodel.visitor import _expression_is_adjustable
+from romodel.util import collect_adjustable, generate_repn_param
+from romodel.visitor import component_is_adjustable
 
 
 class BaseAdjustableTransformation(Transformation):
     def __init__(self):
         self._fixed_components = {}
+        # Time and number of generated vars and constraints per component
+        self.profile = {}
 
     def get_adjustable_components(self, instance, component=Constraint):
         """ Return all uncertain components of type `component`. """
         comp_list = instance.component_data_objects(component, active=True)
         for c in comp_list:
-            if hasattr(c, 'body'):
-                # Constraints
-                expr = c.body
-            else:
-                # Objective
-                expr = c.expr
-
-            if _expression_is_adjustable(expr):
+            if component_is_adjustable(c):
                 yield c
 
     def fix_component(self, instance, component=Var):
@@ -41,10 +36,16 @@ class BaseAdjustableTransformation(Transformation):
         self._fixed_components[component] = None
 
     def generate_repn_param(self, instance, expr):
-        self.fix_component(instance, component=Var)
-        repn = generate_standard_repn(expr, compute_values=False)
-        self.unfix_component(component=Var)
-        return repn
+        return generate_repn_param(expr)
+
+    def _profile(self, name, start, nvars, ncons):
+        """
+        Record the time since `start` and the number of variables and
+        constraints generated for component `name`.
+        """
+        self.profile[name] = {'time': time.time() - start,
+                              'vars': nvars,
+                              'constraints': ncons}
 
 
 @TransformationFactory.register('romodel.adjustable.ldr',
@@ -58,9 +59,12 @@ class LDRAdjustableTransformation(BaseAdjustableTransformation):
         self._expr_dict = {}
 
     def _apply_to(self, instance):
+        self.profile = {}
         for c in chain(self.get_adjustable_components(instance),
                        self.get_adjustable_components(instance,
                                                       component=Objective)):
+            start = time.time()
+            nvars = 0
             # Collect adjustable vars and uncparams
             adjvar = collect_adjustable(c)
             if id(adjvar) not in self._adjvars:
@@ -74,6 +78,7 @@ class LDRAdjustableTransformation(BaseAdjustableTransformation):
                         coef_name = adjvar.name + '_' + parent.name + '_coef'
                         setattr(instance, coef_name, coef)
                         self._coef_dict[adjvar.name, parent.name] = coef
+                        nvars += len(coef)
 
             # Create substitution map
             def coef(u):
@@ -132,9 +137,12 @@ class LDRAdjustableTransformation(BaseAdjustableTransformation):
                     setattr(instance, c.name + '_ldr', c_new)
 
             c.deactivate()
+            ncons = len(c_new) if c.ctype is Constraint else 0
+            self._profile(c.name, start, nvars, ncons)
 
         # Add constraints for bounds on AdjustableVar
         for name, sub_map in self._expr_dict.items():
+            start = time.time()
             adjvar = instance.find_component(name)
             cl = ConstraintList()
             setattr(instance, adjvar.name + '_bounds', cl)
@@ -143,6 +151,7 @@ class LDRAdjustableTransformation(BaseAdjustableTransformation):
                     cl.add(adjvar[i].lb <= sub_map[id(adjvar[i])])
                 if adjvar[i].has_ub():
                     cl.add(adjvar[i].ub >= sub_map[id(adjvar[i])])
+            self._profile(cl.name, start, 0, len(cl))
 
 
 @TransformationFactory.register('romodel.adjustable.nominal',
@@ -155,9 +164,12 @@ class NominalAdjustableTransformation(BaseAdjustableTransformation):
         self._cons_dict = {}
 
     def _apply_to(self, instance):
+        self.profile = {}
         for c in chain(self.get_adjustable_components(instance),
                        self.get_adjustable_components(instance,
                                                       component=Objective)):
+            start = time.time()
+            nvars = 0
             # Collect adjustable var
             adjvar = collect_adjustable(c)
             # Get regular var
@@ -165,6 +177,7 @@ class NominalAdjustableTransformation(BaseAdjustableTransformation):
                 var = Var(adjvar.index_set(), bounds=adjvar._bounds_init_value)
                 setattr(instance, adjvar.name + '_nominal', var)
                 self._adjvar_dict[adjvar.name] = var
+                nvars = len(var)
                 for i in adjvar:
                     var[i].fixed = adjvar[i].fixed
                     var[i].setlb(adjvar[i].lb)
@@ -189,3 +202,5 @@ class NominalAdjustableTransformation(BaseAdjustableTransformation):
             self._cons_dict[c.name] = (c, c_new)
 
             c.deactivate()
+            self._profile(c.name, start, nvars,
+                          1 if c.ctype is Constraint else 0)
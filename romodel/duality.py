@@ -24,7 +24,9 @@ collects information that is used to compute a linear dual of a given
 block.
 """
 
-__all__ = ("create_linear_dual_from",)
+__all__ = ("create_linear_dual_from",
+           "create_linear_dual_from_sparse",
+           "create_linear_dual_from_matrix_repn")
 
 from pyutilib.misc import Bunch
 from pyomo.repn import generate_standard_repn
@@ -42,6 +44,11 @@ from pyomo.core import (Var,
                         quicksum,
                         ConcreteModel)
 from pyomo.core.expr.visitor import identify_variables
+from pyomo.core.expr.numeric_expr import LinearExpression
+from pyomo.core.expr.numvalue import native_numeric_types
+import numpy as np
+import scipy.sparse
+from romodel.util import coef_pattern
 
 
 def collect_dual_representation(block, fixed_modelvars):
@@ -79,6 +86,24 @@ def collect_dual_representation(block, fixed_modelvars):
 
     all_vars = {}
 
+    # Names of the parent components of variables, computed once per parent
+    varnames = {}
+
+    def getvarname(var):
+        parent = var.parent_component()
+        name = varnames.get(id(parent), None)
+        if name is None:
+            try:
+                # The variable is in the subproblem
+                name = parent.getname(fully_qualified=True,
+                                      relative_to=block)
+            except RuntimeError:
+                # The variable is somewhere else in the model
+                name = parent.getname(fully_qualified=True,
+                                      relative_to=block.model())
+            varnames[id(parent)] = name
+        return name
+
     A = {}
     b_coef = {}
     obj_offset = 0
@@ -105,14 +130,7 @@ def collect_dual_representation(block, fixed_modelvars):
                 parent = var.parent_component()
                 if parent is None:
                     raise RuntimeError("ERROR: Variable %s encountered that is not owned by a Pyomo model" % str(var))
-                try:
-                    # The variable is in the subproblem
-                    varname = parent.getname(fully_qualified=True,
-                                                             relative_to=block)
-                except RuntimeError:
-                    # The variable is somewhere else in the model
-                    varname = parent.getname(fully_qualified=True,
-                                                             relative_to=block.model())
+                varname = getvarname(var)
                 varndx = var.index()
                 all_vars[varname, varndx] = var
                 c_rhs[varname, varndx] = coef
@@ -153,14 +171,7 @@ def collect_dual_representation(block, fixed_modelvars):
                     #body_terms.constant += coef*var
                     #continue
                 nvars += 1
-                try:
-                    # The variable is in the subproblem
-                    varname = var.parent_component().getname(fully_qualified=True,
-                                                             relative_to=block)
-                except RuntimeError:
-                    # The variable is somewhere else in the model
-                    varname = var.parent_component().getname(fully_qualified=True,
-                                                             relative_to=block.model())
+                varname = getvarname(var)
                 varndx = var.index()
                 all_vars[varname, varndx] = var
                 for dvar in dualvars:
@@ -316,10 +327,9 @@ def create_linear_dual_from(block, fixed=None, unfixed=None):
     """
     Construct a block that represents the dual of the given block.
 
-    The resulting block contains variables and constraints whose names are
-    the dual names of the primal block.  Note that this involves a many
-    string operations.  A quicker operations could be executed, but it
-    would generate a dual representation that is difficult to interpret.
+    The resulting block contains the indexed dual variables `var` and dual
+    constraints `cons`. Their names in the primal block are stored in the
+    lists `var_keys` and `con_keys` as (name, index) tuples.
 
     Note that the dualization of a maximization problem is performed by
     negating objective and right-hand side coefficients after dualizing
@@ -400,104 +410,185 @@ def create_linear_dual_from(block, fixed=None, unfixed=None):
                     collect_dual_representation(block, fixed_modelvars)
 
     #
-    # Construct the block
+    # Number the dual variables and dual constraints and store A as sparse
+    # rows of (column, coefficient) pairs
+    #
+    var_keys = list(v_domain)
+    col = {key: j for j, key in enumerate(var_keys)}
+    con_keys = []
+    rows = []
+    for cname in A:
+        for ndx, terms in A[cname].items():
+            con_keys.append((cname, ndx))
+            rows.append([(col[term.var, term.ndx], term.coef)
+                         for term in terms])
+    #
+    # The dualization of a maximization problem is handled by simply negating
+    # the objective and left-hand side coefficients while keeping the dual
+    # sense. Note that rhs_multiplier is 1 if the dual is a maximization
+    # problem and -1 otherwise.
     #
-    if isinstance(block, Model):
+    rhs_multiplier = -1 if d_sense == minimize else 1
+    b = [rhs_multiplier*b_coef[key] for key in var_keys]
+    c = [rhs_multiplier*c_rhs.get(key, 0.0) for key in con_keys]
+    sense = [c_sense[key] for key in con_keys]
+    domain = [v_domain[key] for key in var_keys]
+
+    dual = create_linear_dual_from_sparse(rows, b, c, sense, domain, d_sense,
+                                          obj_constant=obj_constant,
+                                          model=isinstance(block, Model))
+    # Names of the dual variables and constraints in the primal
+    dual.var_keys = var_keys
+    dual.con_keys = con_keys
+    return dual
+
+
+_domains = {1: NonNegativeReals, -1: NonPositiveReals, 0: Reals}
+
+
+def create_linear_dual_from_sparse(rows, b, c, sense, domain, d_sense,
+                                   obj_constant=0, model=False):
+    """
+    Construct a block with the linear dual
+
+        d_sense obj_constant + b^T v
+        s.t.    A_i v (sense_i) c_i     for each row i of A
+
+    as indexed components, with dual variables `var` and dual constraints
+    `cons` indexed by position.
+
+    Arguments:
+        rows: The sparse rows of A, a list of lists of (column, coefficient)
+              pairs
+        b: The dual objective coefficients
+        c: The dual constraint right-hand sides
+        sense: The sense of each dual constraint ('e', 'l' or 'g')
+        domain: The domain of each dual variable (-1: Nonpositive,
+                0: Unbounded, 1: Nonnegative)
+        d_sense: The sense of the dual objective
+        obj_constant: The constant of the dual objective
+        model: If true, return a ConcreteModel instead of a Block
+
+    Returns:
+        A Block (or ConcreteModel) with components `var`, `o` and `cons`.
+    """
+    if model:
         dual = ConcreteModel()
     else:
         dual = Block()
     dual.construct()
-    _vars = {}
-
-    # Return variable object from name and index (if applicable)
-    def getvar(name, ndx=None):
-        v = _vars.get((name, ndx), None)
-        if v is None:
-            v = Var()
-            if ndx is None:
-                v_name = name
-            elif isinstance(ndx, tuple):
-                v_name = "%s[%s]" % (name, ','.join(map(str, ndx)))
-            else:
-                v_name = "%s[%s]" % (name, str(ndx))
-            setattr(dual, v_name, v)
-            _vars[name, ndx] = v
-        return v
-    #
-    # Construct the objective
-    # The dualization of a maximization problem is handled by simply negating the
-    # objective and left-hand side coefficients while keeping the dual sense.
-    #
-    if d_sense == minimize:
-        dual.o = Objective(expr=obj_constant + sum(- b_coef[name, ndx]*getvar(name, ndx)
-                                    for name, ndx in b_coef), sense=d_sense)
-        rhs_multiplier = -1
-    else:
-        dual.o = Objective(expr=obj_constant + sum(b_coef[name, ndx]*getvar(name, ndx)
-                                    for name, ndx in b_coef), sense=d_sense)
-        rhs_multiplier = 1
-    #
-    # Construct the constraints from dual A matrix
-    #
-    for cname in A:
-        for ndx, terms in A[cname].items():
 
-            # Build left-hand side of constraint
-            expr = 0
-            for term in terms:
-                expr += term.coef * getvar(term.var, term.ndx)
+    dual.var = Var(range(len(b)), within=lambda blk, j: _domains[domain[j]])
+    var = dual.var
+    dual.o = Objective(expr=obj_constant
+                       + quicksum(b[j]*var[j] for j in range(len(b))),
+                       sense=d_sense)
+
+    def cons_rule(blk, i):
+        lhs = quicksum(coef*var[j] for j, coef in rows[i])
+        if sense[i] == 'e':
+            return lhs == c[i]
+        elif sense[i] == 'l':
+            return lhs <= c[i]
+        return lhs >= c[i]
+    dual.cons = Constraint(range(len(rows)), rule=cons_rule)
 
-            #
-            # Assign right-hand side coefficient
-            # Note that rhs_multiplier is 1 if the dual is a maximization problem and -1 otherwise
-            #
-            rhsval = rhs_multiplier*c_rhs.get((cname, ndx), 0.0)
+    return dual
 
-            # Using the correct inequality or equality
-            if c_sense[cname, ndx] == 'e':
-                e = expr - rhsval == 0
-            elif c_sense[cname, ndx] == 'l':
-                e = expr - rhsval <= 0
-            else:
-                e = expr - rhsval >= 0
-            c = Constraint(expr=e)
-
-            # Build constraint name
-            if ndx is None:
-                c_name = cname
-            elif isinstance(ndx, tuple):
-                c_name = "%s[%s]" % (cname, ','.join(map(str, ndx)))
-            else:
-                c_name = "%s[%s]" % (cname, str(ndx))
-
-            # Add new constraint along with its name to the dual
-            setattr(dual, c_name, c)
-
-        # Set variable domains
-        for (name, ndx), domain in v_domain.items():
-            v = getvar(name, ndx)
-            #flag = type(ndx) is tuple and (ndx[-1] == 'lb' or ndx[-1] == 'ub')
-            if domain == 1:
-                v.domain = NonNegativeReals
-            elif domain == -1:
-                v.domain = NonPositiveReals
-            else:
-                # This is possible when the variable's corresponding constraint is an equality
-                v.domain = Reals
 
-    return dual
+def create_linear_dual_from_matrix_repn(c, b, P, d, keys=None, shared=None,
+                                        share=False):
+    """
+    Construct the linear duals of the robust constraints
+
+        c_k^T w <= b_k    for all w with P w <= d,
 
+    i.e. d^T v_k <= b_k, P^T v_k = c_k, v_k >= 0. The column structure of P
+    is extracted once and shared by all constraints, and only nonzero
+    entries of P and d lead to terms.
+
+    Arguments:
+        c: The coefficient vector, or if `keys` is given a sequence (or
+           K x m array) with one coefficient vector per key
+        b: The right-hand side, or if `keys` is given a sequence with one
+           right-hand side per key
+        P: The n x m constraint matrix of the polyhedron, as a NumPy array
+           or scipy.sparse matrix
+        d: The right-hand side of the polyhedron
+        keys: An optional list of tuples, one per robust constraint
+        shared: A block returned for a constraint with the same c and
+                polyhedron. Its dual variables are reused and only the dual
+                objective constraint is added.
+        share: If true, keys with identical coefficient vectors share one
+               set of dual variables and dual constraints
 
-def create_linear_dual_from_matrix_repn(c, b, P, d):
+    Returns:
+        A Block with the dual variables `var`, the dual objective constraint
+        `obj` and the dual constraints `cons`. Without `keys`, `var` is
+        indexed by range(n) and `cons` is a ConstraintList over the columns
+        of P with nonzero entries. With `keys`, `obj` is indexed by the keys
+        and `var` and `cons` by the keys and the row or column of P (only
+        the first of each group of keys with identical c if `share`).
+    """
     blk = Block()
+    blk.construct()
+    P = scipy.sparse.csc_matrix(P)
     n, m = P.shape
-    # Add dual variables
-    blk.var = Var(range(n), within=NonNegativeReals)
+    # Nonzero entries of d and of each column of P. The entries of d may be
+    # expressions (e.g. of mutable Params), only numeric zeros are skipped.
+    d = np.ravel(d).tolist() if isinstance(d, np.ndarray) else list(d)
+    d_nz = [j for j, dj in enumerate(d)
+            if dj.__class__ not in native_numeric_types or dj != 0]
+    d_coefs = [d[j] for j in d_nz]
+    cols = [i for i in range(m) if P.indptr[i] < P.indptr[i + 1]]
+    col_coefs = {i: P.data[P.indptr[i]:P.indptr[i + 1]].tolist()
+                 for i in cols}
+    col_rows = {i: P.indices[P.indptr[i]:P.indptr[i + 1]] for i in cols}
+
+    def linear_expr(coefs, rows, var):
+        return LinearExpression(constant=0,
+                                linear_coefs=coefs,
+                                linear_vars=[var[j] for j in rows])
+
+    if keys is None:
+        if shared is not None:
+            var = [shared.var[j] for j in range(n)]
+            blk.obj = Constraint(expr=linear_expr(d_coefs, d_nz, var) <= b)
+            return blk
+        blk.var = Var(range(n), within=NonNegativeReals)
+        var = [blk.var[j] for j in range(n)]
+        # Dual objective
+        blk.obj = Constraint(expr=linear_expr(d_coefs, d_nz, var) <= b)
+        # Dual constraints
+        blk.cons = ConstraintList()
+        for i in cols:
+            blk.cons.add(linear_expr(col_coefs[i], col_rows[i], var) == c[i])
+        return blk
+
+    coefs = {key: c[k] for k, key in enumerate(keys)}
+    rhs = {key: b[k] for k, key in enumerate(keys)}
+    # Map each key to the key whose dual variables it uses
+    if share:
+        first = {}
+        rep = {key: first.setdefault(coef_pattern(coefs[key]), key)
+               for key in keys}
+        var_keys = list(first.values())
+    else:
+        rep = {key: key for key in keys}
+        var_keys = keys
+    blk.var = Var(var_keys, range(n), within=NonNegativeReals)
+    var = {key: [blk.var[key + (j,)] for j in range(n)] for key in var_keys}
+
     # Dual objective
-    blk.obj = Constraint(expr=quicksum(d[j]*b.var[j] for j in range(n)) <= b)
+    def obj_rule(blk, *key):
+        return linear_expr(d_coefs, d_nz, var[rep[key]]) <= rhs[key]
+    blk.obj = Constraint(keys, rule=obj_rule)
+
     # Dual constraints
-    blk.cons = ConstraintList()
-    for i in range(m):
-        blk.cons.add(quicksum(P[i, j]*b.var[j] for j in range(n)) == c[i])
+    def cons_rule(blk, *index):
+        key, i = index[:-1], index[-1]
+        lhs = linear_expr(col_coefs[i], col_rows[i], var[key])
+        return lhs == coefs[key][i]
+    blk.cons = Constraint(var_keys, cols, rule=cons_rule)
 
     return blk
@@ -1,20 +1,26 @@
+import numpy as np
 from pyomo.core.base.block import declare_custom_block, _BlockData
+from pyutilib.misc import Bunch
 from pyomo.environ import (ConstraintList,
                            Constraint,
                            ConcreteModel,
                            Objective,
+                           Param,
                            Var,
                            quicksum,
                            minimize,
                            maximize,
                            value,
                            SolverFactory)
-from pyomo.core.expr.current import identify_variables
+from pyomo.core.expr.current import (identify_variables,
+                                     identify_mutable_parameters)
 from pyomo.core.expr.visitor import replace_expressions
 from pyomo.repn import generate_standard_repn
 from pyomo.opt import TerminationCondition
+from pyomo.solvers.plugins.solvers.persistent_solver import PersistentSolver
 from romodel import UncParam
-from romodel.visitor import identify_parent_components
+from romodel.visitor import analyze_expression
+from romodel.uncset.polyhedral import PolyhedralSet, adjacent_vertices
 
 
 @declare_custom_block(name='RobustConstraint')
@@ -31,20 +37,43 @@ class RobustConstraintData(_BlockData):
         self._uncparam = None
         self._uncset = None
         self._vars = []
-        self._sep = None
+        # Separation model and constant term of the constraint. Kept in a
+        # plain holder since assigning a Pyomo component (or expression) to
+        # an attribute of the block would add it to the block
+        self._separation = Bunch(model=None, portable=None, constant=0)
+        self.opt = None
+        self.new_cuts = []
+        self.removed_cuts = []
+        self.resent_cuts = []
+        self._cut_points = []
+        self._init_cut_pool()
+
+    def _init_cut_pool(self):
+        # Cut pool: scenario key -> cut, and per cut the number of
+        # consecutive iterations it was slack
+        self._pool = {}
+        self._age = {}
+        self._pool_stats = {'duplicates': 0,
+                            'deactivated': 0,
+                            'reactivated': 0}
 
     def build(self, lower, expr, upper):
         # Collect uncertain parameter and uncertainty set
         self.lower = lower
         self.upper = upper
-        self._uncparam = _collect_uncparam(expr)
+        repn, parents = analyze_expression(expr)
+        self._uncparam = parents[UncParam]
         self._uncset = [self._uncparam[0]._uncset]
-        self._rule = self.construct_rule(expr)
+        self._rule = self.construct_rule(expr, repn=repn)
+        self._separation.model = None
+        self._separation.portable = None
+        self.opt = None
         self._bounds = (lower, upper)
         # Generate nominal constraint
         nominal_expr = self.nominal_constraint_expr()
         self._constraints = ConstraintList()
         self._constraints.add(nominal_expr)
+        self._init_cut_pool()
 
     def has_lb(self):
         if self.lower is None or self.lower is float('-inf'):
@@ -58,35 +87,186 @@ class RobustConstraintData(_BlockData):
         else:
             return True
 
-    def _add_cut(self, sense):
+    def _separate(self, sense, worst_case=None, candidates=None,
+                  max_cuts=1):
+        res = None
+        if worst_case is not None:
+            res = worst_case.get(sense)
+        if res is None:
+            res = self._worst_case(sense)
+        if res is None:
+            res = self._solve_separation_problem(sense)
+        obj, point = res
+
+        if sense is minimize:
+            feasible = value(self.lower <= obj + self.eps)
+            violation = value(self.lower - obj)
+        else:
+            feasible = value(obj <= self.upper + self.eps)
+            violation = value(obj - self.upper)
+        self.max_violation = max(self.max_violation, violation)
+
+        if not feasible:
+            self._cut_points.append(point)
+            if max_cuts > 1:
+                self._cut_points.extend(
+                        self._extra_scenarios(sense, point, candidates,
+                                              max_cuts - 1))
+
+        return feasible
+
+    def _extra_scenarios(self, sense, point, candidates, k):
+        """
+        Return up to `k` further violated scenarios in addition to the
+        worst-case `point`, ordered by violation. Scenarios are taken from
+        `candidates` (e.g. worst cases of other constraints sharing the set)
+        and, for library sets, from `UncSet.worst_cases`. For other polyhedral
+        sets the vertices adjacent to `point` are used.
+        """
+        index = list(self._uncparam[0])
+        coef = [value(self._coefs[i]) for i in index]
+        constant = value(self._separation.constant)
+        scenarios = list(candidates) if candidates is not None else []
+        uncset = self._uncset[0]
+        points = []
+        if uncset.is_lib():
+            points = uncset.worst_cases(coef, sense, k + 1)
+        if not points:
+            polyhedron = self._polyhedron()
+            if polyhedron is not None:
+                points = adjacent_vertices(*polyhedron,
+                                           [point[i] for i in index],
+                                           coef, sense, k)
+        for p in points:
+            scenarios.append({i: float(pi) for i, pi in zip(index, p)})
+
+        def key(p):
+            return tuple(int(round(p[i]/self.eps)) for i in index)
+
+        seen = set([key(point)])
+        violated = []
+        for p in scenarios:
+            if key(p) in seen:
+                continue
+            seen.add(key(p))
+            obj = sum(c*p[i] for c, i in zip(coef, index)) + constant
+            if sense is minimize:
+                violation = value(self.lower) - obj
+            else:
+                violation = obj - value(self.upper)
+            if violation > self.eps:
+                violated.append((violation, p))
+        violated.sort(key=lambda v: -v[0])
+        return [p for _, p in violated[:k]]
+
+    def supports_multiple_cuts(self):
+        """
+        True if the uncertainty set provides further scenarios besides the
+        worst case (see `UncSet.worst_cases`), or is polyhedral so that
+        adjacent vertices can be used, such that `separate` can store more
+        than one cut per bound without candidates from other constraints.
+        """
+        if self._polyhedron() is not None:
+            return True
+        uncset = self._uncset[0]
+        if not uncset.is_lib():
+            return False
+        n = len(self._uncparam[0])
+        return len(uncset.worst_cases([1]*n, maximize, 2)) > 1
+
+    def _polyhedron(self):
+        """
+        Matrix representation (P, d) of the uncertainty set if it is
+        polyhedral, P * param <= d, otherwise None.
+        """
+        uncset = self._uncset[0]
+        if isinstance(uncset, PolyhedralSet):
+            return uncset.mat, uncset.rhs
+        if uncset.is_lib():
+            return None
+        cached = uncset.get_cached('polyhedral')
+        if cached is None:
+            # Imported here, romodel.reformulate depends on this module
+            from romodel.reformulate import PolyhedralTransformation
+            xfrm = PolyhedralTransformation()
+            cached = xfrm._extract_matrix_repn(uncset)
+            uncset.set_cached('polyhedral', cached)
+        is_polyhedral, mat, rhs = cached
+        if not is_polyhedral:
+            return None
+        return mat, [value(r) for r in rhs]
+
+    def _worst_case(self, sense):
+        """
+        Use the closed form solution of the separation problem if the
+        uncertainty set provides one. Returns the objective value and a dict
+        mapping the parameter index to the worst-case value, or None if no
+        closed form is available.
+        """
+        uncset = self._uncset[0]
+        if not uncset.is_lib():
+            return None
+        index = list(self._uncparam[0])
+        coef = [value(self._coefs[i]) for i in index]
+        point = uncset.worst_case(coef, sense)
+        if point is None:
+            return None
+        obj = (sum(c*p for c, p in zip(coef, point))
+               + value(self._separation.constant))
+        return obj, {i: float(p) for i, p in zip(index, point)}
+
+    def _solve_separation_problem(self, sense):
         sep = self.construct_separation_problem(sense=sense)
         sep.name = "Sep"
-        if not sep.obj.expr.is_constant():
-            res = self.opt.solve(sep)
+        if any(sep.coef[i].value != 0 for i in sep.coef):
+            if isinstance(self.opt, PersistentSolver):
+                # Only the objective changes between iterations
+                if not self._opt_loaded:
+                    self.opt.set_instance(sep)
+                    self._opt_loaded = True
+                else:
+                    self.opt.set_objective(sep.obj)
+                res = self.opt.solve()
+            else:
+                res = self.opt.solve(sep)
             if (res.solver.termination_condition
                     is not TerminationCondition.optimal):
                 raise RuntimeError(
                         "Solver '{}' failed to solve separation "
                         "problem.".format('gurobi')
                         )
-
-        if sense is minimize:
-            feasible = value(self.lower <= sep.obj + self.eps)
+            obj = value(sep.obj)
         else:
-            feasible = value(sep.obj <= self.upper + self.eps)
-
-        if not feasible:
-            uncparam = sep.uncparam
-            expr = self._rule({i: uncparam[i].value for i in uncparam})
-            self._constraints.add((self.lower, expr, self.upper))
-
-        return feasible
-
-    def add_cut(self, solver='gurobi', options={}):
-        """ Solve separation problem and add cut. """
-        self.opt = SolverFactory(solver)
+            obj = sep.constant.value
+
+        uncparam = sep.uncparam
+        return obj, {i: uncparam[i].value for i in uncparam}
+
+    def separate(self, solver='gurobi', options={}, worst_case=None,
+                 candidates=None, max_cuts=1):
+        """
+        Solve the separation problem without modifying the model. Worst-case
+        realizations of violated constraints are stored until
+        `add_violated_cuts` is called, so separation for different
+        generators can run concurrently. The solver is created on the first
+        call and reused as long as `solver` does not change. If it is a
+        persistent solver, the separation problem is loaded into it once and
+        only the objective is updated afterwards. Precomputed solutions, e.g.
+        from `batch_worst_case`, can be passed as `worst_case`, a dict
+        mapping the sense to a tuple (objective, point). If `max_cuts` is
+        larger than one, up to `max_cuts` violated scenarios are stored per
+        bound, taken from `candidates`, `UncSet.worst_cases` or the vertices
+        adjacent to the worst case of a polyhedral set. The largest
+        violation of the bounds is stored in `max_violation`.
+        """
+        if self.opt is None or self._solver_name != solver:
+            self.opt = SolverFactory(solver)
+            self._solver_name = solver
+            self._opt_loaded = False
         for key, val in options.items():
             self.opt.options[key] = val
+        self._cut_points = []
+        self.max_violation = float('-inf')
 
         if 'subsolver_tolerance' in options:
             self.eps = options['subsolver_tolerance']
@@ -95,29 +275,126 @@ class RobustConstraintData(_BlockData):
 
         feasible = True
         if self.has_ub():
-            feasible = feasible and self._add_cut(maximize)
+            feasible = feasible and self._separate(maximize, worst_case,
+                                                   candidates, max_cuts)
 
         if self.has_lb():
-            feasible = feasible and self._add_cut(minimize)
-
-        if feasible is None:
-            import ipdb; ipdb.set_trace()
+            feasible = feasible and self._separate(minimize, worst_case,
+                                                   candidates, max_cuts)
 
         self.feasible = feasible
 
         return feasible
 
-    def construct_separation_problem(self, sense=maximize):
+    def add_violated_cuts(self, max_age=None, tol=1e-6, resend=False):
+        """
+        Add cuts for the realizations found by the last call to `separate`.
+        Realizations which agree with an existing cut within `tol` are not
+        added again; if that cut has been deactivated, it is reactivated
+        instead. If `max_age` is given, cuts which were slack at the current
+        solution for `max_age` consecutive calls are deactivated. Cuts added
+        or reactivated in this call are collected in `new_cuts`, deactivated
+        cuts in `removed_cuts`. With `resend`, violated cuts which are
+        already active are collected in `resent_cuts`.
+        """
+        self.new_cuts = []
+        self.removed_cuts = []
+        self.resent_cuts = []
+        self._age_cuts(max_age, tol)
+        for point in self._cut_points:
+            key = tuple(int(round(point[i]/tol)) for i in point)
+            cut = self._pool.get(key)
+            if cut is None:
+                expr = self._rule(point)
+                cut = self._constraints.add((self.lower, expr, self.upper))
+                self._pool[key] = cut
+            elif cut.active:
+                self._pool_stats['duplicates'] += 1
+                if resend:
+                    self.resent_cuts.append(cut)
+                continue
+            else:
+                cut.activate()
+                self._pool_stats['reactivated'] += 1
+            self._age[id(cut)] = 0
+            self.new_cuts.append(cut)
+        self._cut_points = []
+        return self.new_cuts
+
+    def _age_cuts(self, max_age, tol):
+        for cut in self._pool.values():
+            if not cut.active:
+                continue
+            body = value(cut.body)
+            slack = ((cut.upper is None or body < value(cut.upper) - tol)
+                     and (cut.lower is None or body > value(cut.lower) + tol))
+            if slack:
+                self._age[id(cut)] += 1
+            else:
+                self._age[id(cut)] = 0
+            if max_age is not None and self._age[id(cut)] >= max_age:
+                cut.deactivate()
+                self._pool_stats['deactivated'] += 1
+                self.removed_cuts.append(cut)
+
+    def pool_stats(self):
+        """
+        Return statistics of the cut pool: the number of cuts, the number of
+        active cuts, and counts of skipped duplicates, deactivations and
+        reactivations.
+        """
+        stats = dict(self._pool_stats)
+        stats['cuts'] = len(self._pool)
+        stats['active'] = sum(c.active for c in self._pool.values())
+        return stats
+
+    def add_cut(self, solver='gurobi', options={}):
+        """ Solve separation problem and add cut. """
+        feasible = self.separate(solver=solver, options=options)
+        self.add_violated_cuts()
+        return feasible
+
+    def construct_separation_problem(self, sense=maximize, portable=False):
+        """
+        Return the separation problem for the current values of the
+        variables. The model is built on the first call and reused
+        afterwards, only the objective coefficients and sense are updated.
+        If `portable` is True, a separate model is returned in which the
+        mutable Params of the uncertainty set are replaced by their values,
+        so that it does not reference the original model and can be
+        pickled, e.g. to be solved in another process.
+        """
+        if portable:
+            if self._separation.portable is None:
+                self._separation.portable = self._build_separation_problem(
+                        portable=True)
+            m = self._separation.portable
+        else:
+            if self._separation.model is None:
+                self._separation.model = self._build_separation_problem()
+            m = self._separation.model
+        m.obj.set_sense(sense)
+        # collect current coefficient values
+        for i, coef in self._coefs.items():
+            m.coef[i] = value(coef)
+        m.constant = value(self._separation.constant)
+        return m
+
+    def _build_separation_problem(self, portable=False):
         m = ConcreteModel()
         uncparam = self._uncparam[0]
         index = uncparam.index_set()
+        if portable:
+            # Own copy of the index set, which belongs to the original model
+            index = list(index)
         # Create inner problem variables
         # TODO: use setattr to give uncparam same name as in model
         m.uncparam = Var(index)
-        # collect current coefficient values
-        expr = self._rule(m.uncparam, compute_values=True)
-        # construct objective with current coefficient values
-        m.obj = Objective(expr=expr, sense=sense)
+        # objective coefficients are updated in every iteration
+        m.coef = Param(index, mutable=True, initialize=0)
+        m.constant = Param(mutable=True, initialize=0)
+        expr = quicksum(m.coef[i]*m.uncparam[i] for i in index) + m.constant
+        m.obj = Objective(expr=expr, sense=maximize)
 
         # construct constraints from uncertainty set
         uncset = self._uncset[0]
@@ -125,9 +402,15 @@ class RobustConstraintData(_BlockData):
         substitution_map = {id(uncparam[i]): m.uncparam[i] for i in index}
         if not uncset.is_lib():
             for c in uncset.component_data_objects(Constraint):
-                m.cons.add((c.lower,
+                lower, upper = c.lower, c.upper
+                if portable:
+                    # UncParams are mutable parameters as well
+                    for p in identify_mutable_parameters(c.body):
+                        substitution_map.setdefault(id(p), value(p))
+                    lower, upper = value(lower), value(upper)
+                m.cons.add((lower,
                             replace_expressions(c.body, substitution_map),
-                            c.upper))
+                            upper))
         else:
             for cons in uncset.generate_cons_from_lib(m.uncparam):
                 m.cons.add(cons)
@@ -147,8 +430,9 @@ class RobustConstraintData(_BlockData):
     def is_feasible(self):
         return False
 
-    def construct_rule(self, expr):
-        repn = generate_linear_repn(expr)
+    def construct_rule(self, expr, repn=None):
+        if repn is None:
+            repn = generate_linear_repn(expr)
         linear_vars = repn.linear_vars
         linear_coefs = repn.linear_coefs
         constant = repn.constant
@@ -156,6 +440,8 @@ class RobustConstraintData(_BlockData):
                                                  linear_coefs)}
         param = self._uncparam[0]
         index_coef_dict = {i: id_coef_dict.get(id(param[i]), 0) for i in param}
+        self._coefs = index_coef_dict
+        self._separation.constant = constant
 
         def rule(x, compute_values=False):
             if compute_values:
@@ -167,9 +453,82 @@ class RobustConstraintData(_BlockData):
         return rule
 
 
-def _collect_uncparam(expr):
-    uncparam = [i for i in identify_parent_components(expr, [UncParam])]
-    return uncparam
+def batch_worst_case(generators, solver='gurobi', options={}):
+    """
+    Compute the worst-case realizations of all generators which share a
+    library uncertainty set at once. The current coefficient vectors of the
+    generators are stacked into one matrix and passed to
+    `UncSet.worst_case_batch`. If the set has no closed form, one LP
+    containing the separation problems of all generators in the group is
+    solved instead.
+
+    :return: dict mapping generator names to dicts {sense: (obj, point)}
+    which can be passed to `RobustConstraintData.separate`.
+    """
+    groups = {}
+    for g in generators:
+        uncset = g._uncset[0]
+        if uncset.is_lib():
+            groups.setdefault(id(uncset), []).append(g)
+
+    res = {}
+    for group in groups.values():
+        # Nothing to gain for a single generator
+        if len(group) < 2:
+            continue
+        uncset = group[0]._uncset[0]
+        rows = [(g, s) for g in group
+                for s, has in ((maximize, g.has_ub()), (minimize, g.has_lb()))
+                if has]
+        coef = np.array([[value(g._coefs[i]) for i in g._uncparam[0]]
+                         for g, _ in rows])
+        sense = [s for _, s in rows]
+        points = uncset.worst_case_batch(coef, sense)
+        if points is None:
+            points = _solve_batch_separation(uncset, coef, sense,
+                                             solver, options)
+        obj = (coef*points).sum(axis=1)
+        for k, (g, s) in enumerate(rows):
+            point = {i: float(p) for i, p in zip(g._uncparam[0], points[k])}
+            obj_k = obj[k] + value(g._separation.constant)
+            res.setdefault(g.name, {})[s] = (obj_k, point)
+    return res
+
+
+def _solve_batch_separation(uncset, coef, sense, solver, options):
+    """
+    Solve the separation problems for the rows of `coef` as a single LP.
+    The problems are independent, so maximizing the sum of the (signed)
+    objectives solves each of them.
+    """
+    m = ConcreteModel()
+    K, N = range(coef.shape[0]), range(coef.shape[1])
+    m.uncparam = Var(K, N)
+    m.cons = ConstraintList()
+    for k in K:
+        for cons in uncset.generate_cons_from_lib({j: m.uncparam[k, j]
+                                                   for j in N}):
+            m.cons.add(cons)
+    sign = [-1 if s is minimize else 1 for s in sense]
+    m.obj = Objective(expr=quicksum(sign[k]*coef[k, j]*m.uncparam[k, j]
+                                    for k in K for j in N
+                                    if coef[k, j] != 0),
+                      sense=maximize)
+    opt = SolverFactory(solver)
+    for key, val in options.items():
+        opt.options[key] = val
+    if isinstance(opt, PersistentSolver):
+        opt.set_instance(m)
+        res = opt.solve()
+    else:
+        res = opt.solve(m)
+    if (res.solver.termination_condition
+            is not TerminationCondition.optimal):
+        raise RuntimeError(
+                "Solver '{}' failed to solve batched separation "
+                "problem.".format(solver)
+                )
+    return np.array([[m.uncparam[k, j].value for j in N] for k in K])
 
 
 def generate_linear_repn(expr, evaluate=False):
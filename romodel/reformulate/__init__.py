@@ -1,5 +1,6 @@
 from .base import (BaseRobustTransformation, GeneratorTransformation,
-                   NominalTransformation, UnknownTransformation)
+                   NominalTransformation, UnknownTransformation,
+                   classify_components)
 from .ellipsoidal import EllipsoidalTransformation
 from .polyhedral import PolyhedralTransformation
 from .gp import GPTransformation
@@ -5,18 +5,66 @@ from pyomo.environ import (Constraint,
                            maximize,
                            minimize)
 from pyomo.core import Transformation, TransformationFactory
-from pyomo.repn import generate_standard_repn
-from romodel.visitor import _expression_is_uncertain
+from romodel.visitor import component_is_uncertain, analyze_component
 from romodel.generator import RobustConstraint
+import time
 from itertools import chain
-from romodel.util import collect_uncparam
+from romodel.util import (collect_uncparam,
+                          count_vars_and_cons,
+                          coef_pattern)
 from pyomo.core.expr.visitor import replace_expressions
 
 
+def collect_uncparam_and_uncset(c):
+    """ Return the UncParam and UncSet of an uncertain component. """
+    param = collect_uncparam(c)
+    uncset = param._uncset
+    assert uncset is not None, ("No uncertainty set provided for "
+                                "uncertain parameter {}."
+                                .format(param.name))
+
+    # Check if uncertainty set is empty
+    assert not uncset.is_empty(), ("{} does not have any "
+                                   "constraints.".format(uncset.name))
+    return param, uncset
+
+
+def classify_components(instance, transformations):
+    """
+    Assign every uncertain constraint and objective of `instance` to the
+    first transformation in `transformations` which is applicable to its
+    uncertainty set. Each component is visited once and applicability is
+    checked once per UncSet.
+
+    :return: dict mapping each transformation to a list of tuples
+    (component, UncParam, UncSet), components without an applicable
+    transformation are listed under None.
+    """
+    xfrm = BaseRobustTransformation()
+    groups = {t: [] for t in transformations}
+    groups[None] = []
+    dispatch = {}
+    for c in chain(xfrm.get_uncertain_components(instance),
+                   xfrm.get_uncertain_components(instance,
+                                                 component=Objective)):
+        param, uncset = collect_uncparam_and_uncset(c)
+        if id(uncset) not in dispatch:
+            dispatch[id(uncset)] = next(
+                    (t for t in transformations
+                     if t._check_applicability(uncset)), None)
+        groups[dispatch[id(uncset)]].append((c, param, uncset))
+    return groups
+
+
 class BaseRobustTransformation(Transformation):
     def __init__(self):
         self._fixed_unc_params = []
         self._fixed_components = {}
+        # Time and number of generated vars and constraints per component
+        self.profile = {}
+        # Parts of counterparts which only depend on the uncertainty set and
+        # the coefficients of the uncertain parameters, see `_shared_key`
+        self._shared = {}
 
     def fix_component(self, instance, component=Var):
         fixed = []
@@ -35,57 +83,68 @@ class BaseRobustTransformation(Transformation):
         """ Return all uncertain components of type `component`. """
         comp_list = instance.component_data_objects(component, active=True)
         for c in comp_list:
-            if hasattr(c, 'body'):
-                # Constraints
-                expr = c.body
-            else:
-                # Objective
-                expr = c.expr
-
-            if _expression_is_uncertain(expr):
+            if component_is_uncertain(c):
                 yield c
 
     def generate_repn_param(self, cdata):
-        # Get instance
-        instance = self._instance
-        # Fix variables
-        self.fix_component(instance, component=Var)
-        if hasattr(cdata, 'body'):
-            expr = cdata.body
-        else:
-            expr = cdata.expr
-        repn = generate_standard_repn(expr, compute_values=False)
-        self.unfix_component(component=Var)
-        return repn
-
-    def _apply_to(self, instance, **kwargs):
+        return analyze_component(cdata)[0]
+
+    def _apply_to(self, instance, components=None, **kwargs):
+        """
+        Reformulate all uncertain constraints and objectives to which the
+        transformation is applicable. If `components` is given, only the
+        listed tuples (component, UncParam, UncSet) are reformulated and
+        applicability is not checked again (see `classify_components`).
+        """
         self._instance = instance
-        for c in chain(self.get_uncertain_components(instance),
-                       self.get_uncertain_components(instance,
-                                                     component=Objective)):
-            # Collect unc. parameter and unc. set
-            param = collect_uncparam(c)
-            uncset = param._uncset
-            assert uncset is not None, ("No uncertainty set provided for "
-                                        "uncertain parameter {}."
-                                        .format(param.name))
-
-            # Check if uncertainty set is empty
-            assert not uncset.is_empty(), ("{} does not have any "
-                                           "constraints.".format(uncset.name))
-            # Check if reformulation is applicable to constraint & UncSet
-            if self._check_applicability(uncset):
-                # Check constraint
-                if c.ctype is Constraint:
-                    self._check_constraint(c)
-                else:
-                    self._check_objective(c)
-
-                counterpart = Block()
-                setattr(instance, c.name + '_counterpart', counterpart)
-                self._reformulate(c, param, uncset, counterpart, **kwargs)
-
-                c.deactivate()
+        self.profile = {}
+        self._shared = {}
+        if components is None:
+            components = []
+            for c in chain(self.get_uncertain_components(instance),
+                           self.get_uncertain_components(instance,
+                                                         component=Objective)):
+                param, uncset = collect_uncparam_and_uncset(c)
+                # Check if reformulation is applicable to constraint & UncSet
+                if self._check_applicability(uncset):
+                    components.append((c, param, uncset))
+
+        for c, param, uncset in components:
+            # Check constraint
+            if c.ctype is Constraint:
+                self._check_constraint(c)
+            else:
+                self._check_objective(c)
+
+            start = time.time()
+            counterpart = Block()
+            setattr(instance, c.name + '_counterpart', counterpart)
+            self._reformulate(c, param, uncset, counterpart, **kwargs)
+            # Counterparts can be empty, e.g. if they are collected in a
+            # batch, and are not kept in that case
+            if next(counterpart.component_objects(), None) is None:
+                instance.del_component(counterpart)
+
+            c.deactivate()
+            self._profile(c.name, start, counterpart)
+
+    def _shared_key(self, uncset, coefs):
+        """
+        Return the key under which counterpart parts are shared between
+        components with the same uncertainty set and identical coefficients
+        `coefs` of the uncertain parameters.
+        """
+        return (id(uncset), coef_pattern(coefs))
+
+    def _profile(self, name, start, block):
+        """
+        Record the time since `start` and the size of the block generated
+        for component `name`.
+        """
+        nvars, ncons = count_vars_and_cons(block)
+        self.profile[name] = {'time': time.time() - start,
+                              'vars': nvars,
+                              'constraints': ncons}
 
     def _reformulate(self, c, param, uncset, counterpart, **kwargs):
         raise NotImplementedError
@@ -180,10 +239,14 @@ class NominalTransformation(BaseRobustTransformation):
 @TransformationFactory.register('romodel.unknown',
                                 doc="Check for unknown uncertainty sets.")
 class UnknownTransformation(BaseRobustTransformation):
-    def _apply_to(self, instance):
-        for c in chain(self.get_uncertain_components(instance),
-                       self.get_uncertain_components(instance,
-                                                     component=Objective)):
+    def _apply_to(self, instance, components=None):
+        if components is None:
+            components = chain(self.get_uncertain_components(instance),
+                               self.get_uncertain_components(
+                                   instance, component=Objective))
+        else:
+            components = (c for c, _, _ in components)
+        for c in components:
             # Collect UncParam and UncSet
             param = collect_uncparam(c)
             uncset = param.uncset
@@ -1,9 +1,16 @@
-from pyomo.environ import Constraint, Var, quicksum, sqrt, Objective, Block
+from pyomo.environ import (Constraint,
+                           Var,
+                           quicksum,
+                           sqrt,
+                           Objective,
+                           Block,
+                           native_numeric_types)
 from romodel.reformulate import BaseRobustTransformation
 from pyomo.core import TransformationFactory
 from pyomo.repn import generate_standard_repn
 from romodel.uncset import UncSet, EllipsoidalSet
 import numpy as np
+import scipy.linalg
 
 
 @TransformationFactory.register('romodel.ellipsoidal',
@@ -21,39 +28,81 @@ class EllipsoidalTransformation(BaseRobustTransformation):
             return True
         # Check generic set
         elif uncset.__class__ == UncSet:
-            first_constraint = True
-            is_ellipsoidal = False
-            for c in uncset.component_data_objects(Constraint, active=True):
-                # make sure set has only one constraint
-                if first_constraint:
-                    first_constraint = False
-                else:
-                    return False
-                # Check if constraint is ellipsoidal
-                repn = generate_standard_repn(c.body)
-                if not repn.is_quadratic():
-                    return False
-                # TODO: assumes implicitly that there is one UncParam per UncSet
-                param = repn.quadratic_vars[0][0].parent_component()
-                # Collect covariance matrix and mean
-                quadratic_coefs = {(id(x[0]), id(x[1])): c for x, c in
-                                   zip(repn.quadratic_vars, repn.quadratic_coefs)}
-                invcov = [[quadratic_coefs.get((id(param[i]), id(param[j])), 0)
-                           for i in param] for j in param]
-                invcov = np.array(invcov)
-                invcov = 1/2*(invcov + invcov.T)
-                eig, _ = np.linalg.eig(invcov)
-                cov = np.linalg.inv(invcov)
-                mean = -1/2*np.matmul(cov, np.array(repn.linear_coefs))
-                uncset.mean = {x: mean[i] for i, x in enumerate(param)}
-                uncset.cov = cov.tolist()
+            # Reuse the extracted mean and covariance if the set has not
+            # changed
+            cached = uncset.get_cached('ellipsoidal')
+            if cached is None:
+                cached = self._extract_ellipsoid(uncset)
+                uncset.set_cached('ellipsoidal', cached)
+            is_ellipsoidal, mean, cov, invcov, factor = cached
+            if is_ellipsoidal:
+                uncset.mean = mean
+                uncset.cov = cov
                 uncset.invcov = invcov
-                # TODO: need to check repn.constant == mean^T * cov * mean?
+                uncset.factor = factor
+            return is_ellipsoidal
 
-                is_ellipsoidal = ((c.has_ub() and np.all(eig > 0))
-                                  or (c.has_lb() and np.all(eig < 0)))
+    def _extract_ellipsoid(self, uncset):
+        """
+        Extract mean and covariance from a generic UncSet with a single
+        constraint (w - mean)^T * cov^-1 * (w - mean) <= 1. Returns a tuple
+        (is_ellipsoidal, mean, cov, invcov, factor).
 
-            return is_ellipsoidal
+            uncset: UncSet
+
+        """
+        first_constraint = True
+        is_ellipsoidal = False
+        mean, cov, invcov, factor = None, None, None, None
+        for c in uncset.component_data_objects(Constraint, active=True):
+            # make sure set has only one constraint
+            if first_constraint:
+                first_constraint = False
+            else:
+                return False, None, None, None, None
+            # Check if constraint is ellipsoidal
+            repn = generate_standard_repn(c.body)
+            if not repn.is_quadratic():
+                return False, None, None, None, None
+            # TODO: assumes implicitly that there is one UncParam per UncSet
+            param = repn.quadratic_vars[0][0].parent_component()
+            # Collect covariance matrix and mean
+            quadratic_coefs = {(id(x[0]), id(x[1])): c for x, c in
+                               zip(repn.quadratic_vars, repn.quadratic_coefs)}
+            coefs = {id(x): c for x, c in zip(repn.linear_vars,
+                                                repn.linear_coefs)}
+            invcov = [[quadratic_coefs.get((id(param[i]), id(param[j])), 0)
+                       for i in param] for j in param]
+            invcov = np.array(invcov)
+            invcov = 1/2*(invcov + invcov.T)
+            b = np.array([coefs.get(id(param[i]), 0) for i in param])
+            # (w - mean)^T * cov^-1 * (w - mean) <= 1 or, equivalently,
+            # -(w - mean)^T * cov^-1 * (w - mean) >= -1
+            if c.has_ub():
+                sign = 1
+            elif c.has_lb():
+                sign = -1
+            else:
+                return False, None, None, None, None
+            # Positive definiteness check via Cholesky: cov^-1 = R * R^T
+            try:
+                R = np.linalg.cholesky(sign*invcov)
+            except np.linalg.LinAlgError:
+                return False, None, None, None, None
+            # cov = R^-T * R^-1, i.e. factor = R^-T
+            Rinv = scipy.linalg.solve_triangular(R, np.eye(len(b)),
+                                                 lower=True)
+            factor = Rinv.T
+            cov = factor.dot(Rinv)
+            mean = -1/2*scipy.linalg.cho_solve((R, True), sign*b)
+            mean = {x: mean[i] for i, x in enumerate(param)}
+            cov = cov.tolist()
+            invcov = sign*invcov
+            # TODO: need to check repn.constant == mean^T * cov * mean?
+
+            is_ellipsoidal = True
+
+        return is_ellipsoidal, mean, cov, invcov, factor
 
     def _check_constraint(self, c):
         """
@@ -76,7 +125,8 @@ class EllipsoidalTransformation(BaseRobustTransformation):
         """
         pass
 
-    def _reformulate(self, c, param, uncset, counterpart, root=False):
+    def _reformulate(self, c, param, uncset, counterpart, root=False,
+                     factor=False, share=True):
         """
         Reformulate an uncertain constraint or objective
 
@@ -84,9 +134,15 @@ class EllipsoidalTransformation(BaseRobustTransformation):
             param: UncParam
             uncset: UncSet
             counterpart: Block
+            root: use sqrt(padding) instead of an auxiliary padding variable
+            factor: write the padding as ||L^T * x||^2 with cov = L * L^T,
+                    using auxiliary variables for L^T * x, so that the
+                    padding constraint is a second-order cone
+            share: reuse the padding of a previous constraint or objective
+                   with the same `uncset` and identical coefficients of the
+                   uncertain parameters
 
         """
-
         # Check constraint/objective
         repn = self.generate_repn_param(c)
         assert repn.is_linear(), (
@@ -100,51 +156,118 @@ class EllipsoidalTransformation(BaseRobustTransformation):
         param_var_dict = {id(param): var
                           for param, var
                           in zip(repn.linear_vars, repn.linear_coefs)}
+        x = [param_var_dict.get(id(param[i]), 0) for i in param]
+        key = self._shared_key(uncset, x) if share else None
+
+        # The padding expression (and its auxiliary variables) is built once
+        # per constraint or objective, even if it has two bounds
+        if not root and (not share or key not in self._shared):
+            padding = self._padding(x, uncset, counterpart, factor=factor)
+
+        def padding_var(blk, name):
+            """
+            Return the padding variable, adding it to `blk` together with
+            the constraint `name` defining it unless it is shared.
+            """
+            pvar = self._shared.get(key) if share else None
+            if pvar is None:
+                blk.padding = Var(bounds=(0, float('inf')))
+                pvar = blk.padding
+                setattr(blk, name, Constraint(expr=padding <= pvar**2))
+                if share:
+                    self._shared[key] = pvar
+            return pvar
+
         # padding = sqrt( var^T * cov^-1 * var )
-        padding = quicksum(param_var_dict[id(param[ind_i])]
-                           * uncset.cov[i][j]
-                           * param_var_dict[id(param[ind_j])]
-                           for i, ind_i in enumerate(param)
-                           for j, ind_j in enumerate(param))
+        if root:
+            root_padding = self._shared.get(key) if share else None
+            if root_padding is None:
+                root_padding = sqrt(self._padding(x, uncset, counterpart,
+                                                  factor=factor))
+                if share:
+                    self._shared[key] = root_padding
         if c.ctype is Constraint:
             # For upper bound: det + padding <= b
             if c.has_ub():
                 counterpart.upper = Block()
                 if root:
-                    expr = det + sqrt(padding) <= c.upper
+                    expr = det + root_padding <= c.upper
                     robust = Constraint(expr=expr)
                 else:
-                    counterpart.upper.padding = Var(bounds=(0, float('inf')))
-                    pvar = counterpart.upper.padding
+                    pvar = padding_var(counterpart.upper, 'det')
                     robust = Constraint(expr=det + pvar <= c.upper())
-                    deterministic = Constraint(expr=padding <= pvar**2)
-                    counterpart.upper.det = deterministic
                 counterpart.upper.rob = robust
             # For lower bound: det - padding >= b
             if c.has_lb():
                 counterpart.lower = Block()
                 if root:
-                    expr = det - sqrt(padding) >= c.lower
+                    expr = det - root_padding >= c.lower
                     robust = Constraint(expr=expr)
                 else:
-                    counterpart.lower.padding = Var(bounds=(0, float('inf')))
-                    pvar = counterpart.lower.padding
+                    pvar = padding_var(counterpart.lower, 'det')
                     robust = Constraint(expr=c.lower() <= det - pvar)
-                    deterministic = Constraint(expr=padding <= pvar**2)
-                    counterpart.lower.det = deterministic
                 counterpart.lower.rob = robust
         else:
             # For minimization: min det + padding
             # For maximization: max det - padding
             sense = c.sense
             if root:
-                expr = det + c.sense*sqrt(padding)
+                expr = det + c.sense*root_padding
                 robust = Objective(expr=expr, sense=sense)
             else:
-                counterpart.padding = Var(bounds=(0, float('inf')))
-                pvar = counterpart.padding
+                pvar = padding_var(counterpart, 'det')
                 robust = Objective(expr=det + sense*pvar, sense=sense)
-                deterministic = Constraint(expr=padding <= pvar**2)
-                counterpart.det = deterministic
             counterpart.rob = robust
 
+    def _padding(self, x, uncset, counterpart, factor=False):
+        """
+        Return an expression for x^T * cov * x. Zero entries of x and cov are
+        skipped and a diagonal covariance leads to a simple sum of squares.
+        If `factor` is True, the padding is always written as sum_k y_k^2
+        with auxiliary variables y = L^T * x added to `counterpart` (also
+        for a diagonal covariance, where L = diag(sqrt(cov_ii))).
+
+            x: list of coefficients of the uncertain parameters
+            uncset: UncSet
+            counterpart: Block
+
+        """
+        cov = np.asarray(uncset.cov, dtype=float)
+        nonzero = [i for i, xi in enumerate(x)
+                   if xi.__class__ not in native_numeric_types or xi != 0]
+        # Factored form: aux = L^T * x, padding = aux^T * aux
+        if factor:
+            return self._factored_padding(x, uncset, counterpart)
+        # Diagonal covariance
+        if not np.any(cov - np.diag(np.diag(cov))):
+            return quicksum(cov[i, i]*x[i]**2 for i in nonzero
+                            if cov[i, i] != 0)
+        # Sparse quadratic form
+        return quicksum(x[i]*cov[i, j]*x[j]
+                        for i in nonzero
+                        for j in nonzero
+                        if cov[i, j] != 0)
+
+    def _factored_padding(self, x, uncset, counterpart):
+        """
+        Return sum_k aux_k^2 where the auxiliary variables aux = L^T * x are
+        added to `counterpart` and cov = L * L^T. Columns of L without
+        nonzero entries for the nonzero entries of x are skipped.
+
+            x: list of coefficients of the uncertain parameters
+            uncset: UncSet
+            counterpart: Block
+
+        """
+        L = uncset.factor
+        nonzero = [i for i, xi in enumerate(x)
+                   if xi.__class__ not in native_numeric_types or xi != 0]
+        rank = [k for k in range(L.shape[1])
+                if any(L[i, k] != 0 for i in nonzero)]
+
+        def aux_rule(b, k):
+            return b.aux[k] == quicksum(L[i, k]*x[i] for i in nonzero
+                                        if L[i, k] != 0)
+        counterpart.aux = Var(rank)
+        counterpart.aux_def = Constraint(rank, rule=aux_rule)
+        return quicksum(counterpart.aux[k]**2 for k in rank)
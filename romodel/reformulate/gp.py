@@ -42,7 +42,7 @@ class GPTransformation(BaseRobustTransformation):
             counterpart: Block
 
         """
-        from rogp.util.numpy import _pyomo_to_np, _to_np_obj_array
+        from rogp.util.numpy import _to_np_obj_array
 
         repn = self.generate_repn_param(c)
 
@@ -56,28 +56,24 @@ class GPTransformation(BaseRobustTransformation):
         x = _to_np_obj_array(x)
 
         # Calculate matrices
-        gp = uncset.gp
         var = uncset.var
-        if type(var) is dict:
-            pass
-            z = [var[i] for i in index_set]
-            z = _to_np_obj_array(z)
-        else:
-            var = var[0]
-            assert var.index_set() == param.index_set(), (
+        if type(var) is not dict:
+            assert var[0].index_set() == param.index_set(), (
                     "Index set of `UncParam` and `var` in `GPSet` "
                     "should be the same. Alternatively use "
                     "var = {index: [list of vars]}"
                     )
-            z = _pyomo_to_np(var, ind=index_set)
-
-        Sig = gp.predict_cov(z)
-        mu = gp.predict_mu(z)
+        if uncset.is_low_rank():
+            # Sig = K C C^T K^T: x^T Sig x = ||C^T K^T x||^2
+            mu, K, C = uncset.predict_factor(index_set)
+            t = np.matmul(C.T, np.matmul(K.T, x))
+            padding = np.matmul(t.T, t)
+        else:
+            mu, Sig = uncset.predict(index_set)
+            padding = np.matmul(x.T, Sig)
+            padding = np.matmul(padding, x)
 
         nominal = np.matmul(mu.T, x)[0, 0] + repn.constant
-
-        padding = np.matmul(x.T, Sig)
-        padding = np.matmul(padding, x)
         padding = uncset.F*pyomo_sqrt(padding[0, 0])
 
         # Counterpart
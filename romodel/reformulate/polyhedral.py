@@ -1,15 +1,13 @@
 from pyomo.environ import (Constraint,
                            Var,
-                           quicksum,
                            Objective,
                            maximize,
-                           minimize,
-                           ConstraintList,
-                           NonNegativeReals,
-                           Block,
-                           native_numeric_types)
+                           minimize)
 from pyomo.core import TransformationFactory
-from romodel.duality import create_linear_dual_from
+import time
+import scipy.sparse
+from romodel.duality import (create_linear_dual_from,
+                             create_linear_dual_from_matrix_repn)
 from romodel.reformulate import BaseRobustTransformation
 from pyomo.repn import generate_standard_repn
 from romodel.uncset import UncSet, PolyhedralSet
@@ -31,32 +29,61 @@ class PolyhedralTransformation(BaseRobustTransformation):
             return True
         # Check generic set:
         elif uncset.__class__ == UncSet:
-            mat = []
-            rhs = []
-            for c in uncset.component_data_objects(Constraint, active=True):
-                # Generate standard repn
-                repn = generate_standard_repn(c.body)
-                param = collect_uncparam(c)
-                # If uncertainty set contains a non-linear constraint it's not
-                # polyhedral.
-                if not repn.is_linear():
-                    return False
-                coef_dict = {id(x): y for x, y in zip(repn.linear_vars,
-                                                      repn.linear_coefs)}
-                if c.has_ub():
-                    mat.append([coef_dict.get(id(param[i]), 0) for i in param])
-                    rhs.append(c.upper - repn.constant)
-                if c.has_lb():
-                    mat.append([-coef_dict.get(id(param[i]), 0) for i in param])
-                    rhs.append(repn.constant - c.lower)
-
-            uncset.mat = mat
-            uncset.rhs = rhs
-
-            return True
+            # Reuse the matrix representation if the set has not changed
+            cached = uncset.get_cached('polyhedral')
+            if cached is None:
+                cached = self._extract_matrix_repn(uncset)
+                uncset.set_cached('polyhedral', cached)
+            is_polyhedral, mat, rhs = cached
+            if is_polyhedral:
+                uncset.mat = mat
+                uncset.rhs = rhs
+            return is_polyhedral
 
         return False
 
+    def _extract_matrix_repn(self, uncset):
+        """
+        Extract P and d from a generic UncSet with constraints P * w <= d.
+        Returns a tuple (is_polyhedral, P, d).
+
+            uncset: UncSet
+
+        """
+        # Collect the nonzero entries of P in coordinate format
+        rows, cols, vals = [], [], []
+        rhs = []
+        n = 0
+        for c in uncset.component_data_objects(Constraint, active=True):
+            # Generate standard repn
+            repn = generate_standard_repn(c.body)
+            param = collect_uncparam(c)
+            # If uncertainty set contains a non-linear constraint it's not
+            # polyhedral.
+            if not repn.is_linear():
+                return False, None, None
+            col = {id(param[i]): j for j, i in enumerate(param)}
+            n = len(col)
+            entries = [(col[id(x)], y) for x, y in zip(repn.linear_vars,
+                                                       repn.linear_coefs)
+                       if id(x) in col and y != 0]
+            if c.has_ub():
+                for j, y in entries:
+                    rows.append(len(rhs))
+                    cols.append(j)
+                    vals.append(y)
+                rhs.append(c.upper - repn.constant)
+            if c.has_lb():
+                for j, y in entries:
+                    rows.append(len(rhs))
+                    cols.append(j)
+                    vals.append(-y)
+                rhs.append(repn.constant - c.lower)
+
+        mat = scipy.sparse.csr_matrix((vals, (rows, cols)),
+                                      shape=(len(rhs), n))
+        return True, mat, rhs
+
     def _check_constraint(self, c):
         """
         Raise an error if the constraint is inappropriate for this
@@ -68,7 +95,21 @@ class PolyhedralTransformation(BaseRobustTransformation):
         assert not c.equality, (
                 "Currently can't handle equality constraints yet.")
 
-    def _reformulate(self, c, param, uncset, counterpart, pao=False):
+    def _apply_to(self, instance, **kwargs):
+        # Robust constraints which are reformulated in batches, grouped by
+        # uncertainty set
+        self._batch = {}
+        super()._apply_to(instance, **kwargs)
+        for uncset, rows, share in self._batch.values():
+            start = time.time()
+            dual = self.create_linear_dual_batch(rows, uncset.mat, uncset.rhs,
+                                                 share=share)
+            setattr(instance, uncset.name + '_dual', dual)
+            self._profile(uncset.name + '_dual', start, dual)
+        self._batch = {}
+
+    def _reformulate(self, c, param, uncset, counterpart, pao=False,
+                     batch=False, share=True):
         """
         Reformulate an uncertain constraint or objective
 
@@ -76,8 +117,17 @@ class PolyhedralTransformation(BaseRobustTransformation):
             param: UncParam
             uncset: UncSet
             counterpart: Block
+            pao: use the PAO-derived dualization of the UncSet block
+            batch: collect the duals of all constraints which share `uncset`
+                   in one indexed block `<uncset>_dual` instead of one block
+                   per constraint
+            share: reuse the dual variables and constraints of a previous
+                   constraint with the same `uncset` and identical
+                   coefficients of the uncertain parameters
 
         """
+        assert not (pao and batch), (
+                "Options 'pao' and 'batch' cannot be used together.")
 
         repn = self.generate_repn_param(c)
         assert repn.is_linear(), (
@@ -90,6 +140,23 @@ class PolyhedralTransformation(BaseRobustTransformation):
         c_coefs = [id_coef_dict.get(id(i), 0) for i in param.values()]
         cons = repn.constant
 
+        def add_dual(name, c, b):
+            if batch:
+                rows = self._batch.setdefault(id(uncset),
+                                              (uncset, [], share))[1]
+                rows.append(((c_name, name), c, b))
+                return
+            shared = None
+            if share:
+                key = self._shared_key(uncset, c)
+                shared = self._shared.get(key)
+            dual = self.create_linear_dual(c, b, uncset.mat, uncset.rhs,
+                                           shared=shared)
+            if share and shared is None:
+                self._shared[key] = dual
+            setattr(counterpart, name, dual)
+
+        c_name = c.name
         # Add dual constraints d^T * v <= b, P^T * v = x
         # Constraint
         if c.ctype is Constraint:
@@ -104,12 +171,9 @@ class PolyhedralTransformation(BaseRobustTransformation):
                     del dual.o
                     dual.o = Constraint(expr=o_expr <= c.upper)
                     del uncset.obj
+                    counterpart.upper = dual
                 else:
-                    dual = self.create_linear_dual(c_coefs,
-                                                   c.upper - cons,
-                                                   uncset.mat,
-                                                   uncset.rhs)
-                counterpart.upper = dual
+                    add_dual('upper', c_coefs, c.upper - cons)
             # GEQ
             if c.has_lb():
                 # Create linear dual
@@ -121,12 +185,11 @@ class PolyhedralTransformation(BaseRobustTransformation):
                     del dual.o
                     dual.o = Constraint(expr=c.lower <= o_expr)
                     del uncset.obj
+                    counterpart.lower = dual
                 else:
-                    dual = self.create_linear_dual([-1*c for c in c_coefs],
-                                                   -1*(c.lower - cons),
-                                                   uncset.mat,
-                                                   uncset.rhs)
-                counterpart.lower = dual
+                    add_dual('lower',
+                             [-1*c for c in c_coefs],
+                             -1*(c.lower - cons))
         # Objective
         else:
             counterpart.epigraph = Var()
@@ -141,32 +204,35 @@ class PolyhedralTransformation(BaseRobustTransformation):
                 del dual.o
                 dual.o = Constraint(expr=sense*o_expr <= sense*epigraph)
                 del uncset.obj
+                counterpart.dual = dual
             else:
-                dual = self.create_linear_dual([sense*c for c in c_coefs],
-                                               sense*(epigraph - cons),
-                                               uncset.mat,
-                                               uncset.rhs)
-            counterpart.dual = dual
+                add_dual('dual',
+                         [sense*c for c in c_coefs],
+                         sense*(epigraph - cons))
             counterpart.obj = Objective(expr=epigraph, sense=sense)
 
-    def create_linear_dual(self, c, b, P, d):
+    def create_linear_dual(self, c, b, P, d, shared=None):
         '''
         Robust constraint:
             c^T*w <= b for all P*w <= d
+
+        If `shared` is the dual block of a constraint with the same c, P
+        and d, its dual variables are reused.
+        '''
+        return create_linear_dual_from_matrix_repn(c, b, P, d, shared=shared)
+
+    def create_linear_dual_batch(self, rows, P, d, share=False):
+        '''
+        Robust constraints:
+            c_k^T*w <= b_k for all P*w <= d,    k = 1, ..., K
+
+        `rows` is a list of (key, c_k, b_k) tuples. All dual variables and
+        constraints are added to one block as indexed components, indexed by
+        the keys. If `share` is True, rows with identical c_k share their
+        dual variables and constraints.
         '''
-        blk = Block()
-        blk.construct()
-        n, m = len(P), len(P[0])
-        # Add dual variables
-        blk.var = Var(range(n), within=NonNegativeReals)
-        # Dual objective
-        blk.obj = Constraint(expr=quicksum(d[j]*blk.var[j]
-                                           for j in range(n)) <= b)
-        # Dual constraints
-        blk.cons = ConstraintList()
-        for i in range(m):
-            lhs = quicksum(P[j][i]*blk.var[j] for j in range(n))
-            if lhs.__class__ not in native_numeric_types or lhs != 0:
-                blk.cons.add(lhs == c[i])
-
-        return blk
+        keys = [key for key, _, _ in rows]
+        return create_linear_dual_from_matrix_repn([c for _, c, _ in rows],
+                                                   [b for _, _, b in rows],
+                                                   P, d, keys=keys,
+                                                   share=share)
@@ -2,7 +2,6 @@ from pyomo.environ import (Constraint,
                            Var,
                            Objective,
                            maximize,
-                           ConstraintList,
                            NonNegativeReals,
                            NonPositiveReals)
 from pyomo.core import TransformationFactory
@@ -107,34 +106,38 @@ class WGPTransformation(BaseRobustTransformation):
         # Calculate matrices
         gp = uncset.gp
         var = uncset.var
-        if type(var) is dict:
-            z = [var[i] for i in index_set]
-            z = _to_np_obj_array(z)
-        else:
-            var = var[0]
-            assert var.index_set() == param.index_set(), (
+        if type(var) is not dict:
+            assert var[0].index_set() == param.index_set(), (
                     "Index set of `UncParam` and `var` in `WarpedGPSet` "
                     "should be the same. Alternatively use "
                     "var = {index: [list of vars]}"
                     )
-            z = _pyomo_to_np(var, ind=index_set)
-
-        Sig = gp.predict_cov_latent(z)
-        mu = gp.predict_mu_latent(z)
-        dHinv = 1/gp.warp_deriv(y)
-        dHinv = np.diag(dHinv[:, 0])
         hz = gp.warp(y)
-
-        LHS = np.matmul(Sig, dHinv)
-        LHS = np.matmul(LHS, x)
-        RHS = LHS
-        LHS = LHS + 2*u*(hz - mu)
-        # Add stationarity condition
-        b.stationarity = ConstraintList()
-        for lhs in np.nditer(LHS, ['refs_ok']):
-            b.stationarity.add(lhs.item() == 0)
-        RHS = np.matmul(dHinv, RHS)
-        rhs = np.matmul(x.T, RHS)[0, 0]
+        # dH^-1 is diagonal: scale x elementwise instead of forming
+        # diag(dH^-1) as a dense matrix
+        dHinv = 1/gp.warp_deriv(y)
+        w = dHinv*x
+        if uncset.is_low_rank():
+            # Sig = K C C^T K^T
+            mu, K, C = uncset.predict_latent_factor(index_set)
+            t = np.matmul(C.T, np.matmul(K.T, w))
+            Sw = np.matmul(K, np.matmul(C, t))
+        else:
+            mu, Sig = uncset.predict_latent(index_set)
+            Sw = np.matmul(Sig, w)
+
+        # Add stationarity condition: Sig dH^-1 x + 2 u (h(y) - mu) = 0
+        pos = {i: k for k, i in enumerate(index_set)}
+
+        def stationarity_rule(b, *i):
+            k = pos[i[0] if len(i) == 1 else i]
+            return Sw[k, 0] + 2*u[0, 0]*(hz[k, 0] - mu[k, 0]) == 0
+        b.stationarity = Constraint(index_set, rule=stationarity_rule)
+        # x^T dH^-1 Sig dH^-1 x
+        if uncset.is_low_rank():
+            rhs = np.matmul(t.T, t)[0, 0]
+        else:
+            rhs = np.matmul(w.T, Sw)[0, 0]
         lhs = 4*u[0, 0]**2*uncset.F
         # Set consistent initial value for u (helps convergence)
         if initialize_wolfe:
@@ -1,11 +1,25 @@
 """ Reformulation solver. """
 import time
+import logging
+import multiprocessing
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
 import pyutilib.misc
 from pyomo.opt import (TerminationCondition,
                        SolverFactory,
                        OptSolver,
                        SolverResults)
-from pyomo.core import TransformationFactory
+from pyomo.core import (TransformationFactory,
+                        Var,
+                        Constraint,
+                        Objective,
+                        maximize,
+                        minimize,
+                        value)
+from pyomo.solvers.plugins.solvers.persistent_solver import PersistentSolver
+from romodel.generator import batch_worst_case
+
+logger = logging.getLogger('romodel.solver.cuts')
 
 
 @SolverFactory.register('romodel.cuts', doc='Robust cutting plane solver.')
@@ -58,45 +72,148 @@ class CuttingPlaneSolver(OptSolver):
         else:
             subsolver = self.options.subsolver
 
+        # Number of worker processes solving separation problems
+        # concurrently
+        if not self.options.separation_threads:
+            threads = 1
+        else:
+            threads = self.options.separation_threads
+        # Not an option of the master solver
+        self.options.pop('separation_threads', None)
+
+        # Maximum number of cuts per constraint bound and iteration. Besides
+        # the worst case, violated scenarios are taken from worst cases of
+        # other constraints with the same uncertain parameter, from library
+        # sets with several closed form worst cases (boxes) and from the
+        # vertices adjacent to the worst case of polyhedral sets. Other sets
+        # (e.g. ellipsoids) only yield a single cut per round for a
+        # constraint which does not share its uncertain parameter, a warning
+        # is logged in that case.
+        if not self.options.cuts_per_round:
+            cuts_per_round = 1
+        else:
+            cuts_per_round = self.options.cuts_per_round
+        self.options.pop('cuts_per_round', None)
+        if cuts_per_round > 1:
+            shared = {}
+            for g in generators:
+                key = id(g._uncparam[0])
+                shared[key] = shared.get(key, 0) + 1
+            limited = [g.name for g in generators
+                       if shared[id(g._uncparam[0])] == 1
+                       and not g.supports_multiple_cuts()]
+            if limited:
+                logger.warning(
+                        "cuts_per_round=%s cannot be honoured for %s: their "
+                        "uncertainty sets provide no further scenarios, only "
+                        "the worst case is added.",
+                        cuts_per_round, ", ".join(limited))
+
+        # Add cuts as lazy constraints in a solver callback. Lazy constraints
+        # are only separated at integer solutions, a continuous master
+        # problem is solved iteratively instead.
+        lazy = self.options.pop('lazy', False)
+        if lazy and all(v.is_continuous() for v in
+                        instance.component_data_objects(Var, active=True)):
+            print("Master problem has no discrete variables, adding cuts "
+                  "iteratively instead of lazily.")
+            lazy = False
+
+        # Deactivate cuts which are slack for this many iterations
+        cut_max_age = self.options.pop('cut_max_age', None)
+
+        # Called with the record of every iteration
+        self._iteration_callback = self.options.pop('iteration_callback',
+                                                    None)
+        self.iteration_log = []
+        # Objective and size of the master problem, the constraint count is
+        # updated with the cuts of each round
+        self._objective = next(
+                instance.component_data_objects(Objective, active=True), None)
+        self._master_size = {
+                'constraints': sum(1 for _ in instance.component_data_objects(
+                    Constraint, active=True)),
+                'variables': sum(1 for _ in instance.component_data_objects(
+                    Var))}
+
         self.options.setdefault('subsolver_options', self.options)
         subsolver_options = self.options.pop('subsolver_options')
 
+        # Separation problems are solved in worker processes, each with its
+        # own solver instance: shell solvers share the process-wide
+        # TempfileManager and in-process solvers the default environment
+        # (e.g. of gurobipy), neither can be used from several threads.
+        # Workers are spawned rather than forked from a process which may
+        # hold solver licenses.
+        pool = None
+        if threads > 1:
+            pool = ProcessPoolExecutor(
+                    max_workers=threads,
+                    mp_context=multiprocessing.get_context('spawn'))
+
         print("Using solver {}\n".format(solver))
 
-        with SolverFactory(solver) as opt:
+        with SolverFactory(solver) as opt, (pool or nullcontext()):
             self.results = []
             feasible = {}
-            # Solve nominal problem
-            print("Solving nominal problem.\n")
             opt.options = self.options
-            results = opt.solve(instance,
-                                tee=self._tee,
-                                timelimit=self._timelimit)
-            # Add initial cut to check feasibility
-            for g in generators:
-                feasible[g.name] = g.add_cut(solver=subsolver,
-                                             options=subsolver_options)
-            feas, total = sum(feasible.values()), len(feasible)
-            print("{0}/{1} constraints robustly feasible. "
-                  "Add cuts and resolve.".format(feas, total))
-            # Keep adding cuts until feasible
-            n_iter = 1
-            while (not all(feasible.values())) and (n_iter < max_iter):
-                if (results.solver.termination_condition
-                        is not TerminationCondition.optimal):
-                    break
-                results = opt.solve(instance,
-                                    tee=self._tee,
-                                    timelimit=self._timelimit)
-                for g in generators:
-                    feasible[g.name] = g.add_cut(solver=subsolver,
-                                                 options=subsolver_options)
+            if lazy:
+                # Separate inside the branch-and-cut tree of the master
+                results, n_iter = self._solve_lazy(
+                        opt, instance, generators, feasible, subsolver,
+                        subsolver_options, pool, cuts_per_round,
+                        max_iter)
                 self.results.append(results)
-
-                n_iter += 1
+            else:
+                # Solve nominal problem
+                print("Solving nominal problem.\n")
+                # Persistent solvers keep the master problem loaded, new cuts
+                # are added incrementally
+                persistent = isinstance(opt, PersistentSolver)
+                master_start = time.time()
+                if persistent:
+                    opt.set_instance(instance)
+                    results = opt.solve(tee=self._tee,
+                                        timelimit=self._timelimit)
+                else:
+                    results = opt.solve(instance,
+                                        tee=self._tee,
+                                        timelimit=self._timelimit)
+                master_time = time.time() - master_start
+                # Add initial cut to check feasibility
+                stats = self._add_cuts(generators, feasible, opt, persistent,
+                                       subsolver, subsolver_options, pool,
+                                       cut_max_age, cuts_per_round)
+                self._log_iteration(0, master_time, stats)
                 feas, total = sum(feasible.values()), len(feasible)
                 print("{0}/{1} constraints robustly feasible. "
                       "Add cuts and resolve.".format(feas, total))
+                # Keep adding cuts until feasible
+                n_iter = 1
+                while (not all(feasible.values())) and (n_iter < max_iter):
+                    if (results.solver.termination_condition
+                            is not TerminationCondition.optimal):
+                        break
+                    master_start = time.time()
+                    if persistent:
+                        results = opt.solve(tee=self._tee,
+                                            timelimit=self._timelimit)
+                    else:
+                        results = opt.solve(instance,
+                                            tee=self._tee,
+                                            timelimit=self._timelimit)
+                    master_time = time.time() - master_start
+                    stats = self._add_cuts(generators, feasible, opt,
+                                           persistent, subsolver,
+                                           subsolver_options, pool,
+                                           cut_max_age, cuts_per_round)
+                    self._log_iteration(n_iter, master_time, stats)
+                    self.results.append(results)
+
+                    n_iter += 1
+                    feas, total = sum(feasible.values()), len(feasible)
+                    print("{0}/{1} constraints robustly feasible. "
+                          "Add cuts and resolve.".format(feas, total))
 
             if all(feasible.values()):
                 print("\nAll constraints robustly feasible after {} "
@@ -105,6 +222,15 @@ class CuttingPlaneSolver(OptSolver):
                 print("\nEnding after reaching max_iter={} iterations. "
                       "Solution is not robustly feasible".format(max_iter))
 
+            # Aggregate cut pool statistics over all generators
+            self.cut_pool_stats = {}
+            for g in generators:
+                for key, val in g.pool_stats().items():
+                    self.cut_pool_stats[key] = (
+                        self.cut_pool_stats.get(key, 0) + val)
+            print("{cuts} cuts in pool, {active} active, {duplicates} "
+                  "duplicates skipped.".format(**self.cut_pool_stats))
+
         self.termination_condition = results.solver.termination_condition
         stop_time = time.time()
         self.wall_time = stop_time - start_time
@@ -117,6 +243,135 @@ class CuttingPlaneSolver(OptSolver):
 
         # Stuff to represent results in robust model
 
+    def _add_cuts(self, generators, feasible, opt, persistent,
+                  subsolver, subsolver_options, pool, cut_max_age,
+                  cuts_per_round, lazy=False):
+        """
+        Solve the separation problems of all generators and add the
+        resulting cuts to the master problem. Generators sharing a library
+        uncertainty set are separated together in one batch. The remaining
+        separation problems without a closed form are independent given the
+        master solution and are solved by the process `pool` if given. Cuts
+        are added serially, cuts which were slack for `cut_max_age`
+        iterations are deactivated. With `cuts_per_round` larger than one,
+        worst cases of constraints sharing an uncertain parameter are also
+        tried as cuts for each other. If `lazy` is set, the cuts are passed
+        to the solver as lazy constraints from within a callback. Returns
+        timing and cut statistics of the round.
+        """
+        batch_start = time.time()
+        worst_case = batch_worst_case(generators, solver=subsolver,
+                                      options=subsolver_options)
+        if pool is not None:
+            _solve_in_pool(pool, generators, worst_case, subsolver,
+                           subsolver_options)
+        batch_time = time.time() - batch_start
+
+        candidates = {}
+        if cuts_per_round > 1:
+            for g in generators:
+                points = candidates.setdefault(id(g._uncparam[0]), [])
+                for _, point in worst_case.get(g.name, {}).values():
+                    points.append(point)
+
+        separation_time = {}
+        results = []
+        for g in generators:
+            g_start = time.time()
+            results.append(g.separate(
+                    solver=subsolver, options=subsolver_options,
+                    worst_case=worst_case.get(g.name),
+                    candidates=candidates.get(id(g._uncparam[0])),
+                    max_cuts=cuts_per_round))
+            separation_time[g.name] = time.time() - g_start
+
+        cuts_added, cuts_removed = 0, 0
+        for g, feas in zip(generators, results):
+            feasible[g.name] = feas
+            # The solver may present a solution violating a lazy constraint
+            # again (e.g. found by another thread), it has to be rejected
+            # again
+            g.add_violated_cuts(max_age=cut_max_age, resend=lazy)
+            cuts_added += len(g.new_cuts)
+            cuts_removed += len(g.removed_cuts)
+            if lazy:
+                for c in g.new_cuts + g.resent_cuts:
+                    opt.cbLazy(c)
+            elif persistent:
+                for c in g.removed_cuts:
+                    opt.remove_constraint(c)
+                for c in g.new_cuts:
+                    opt.add_constraint(c)
+
+        return {'batch_time': batch_time,
+                'separation_time': separation_time,
+                'cuts_added': cuts_added,
+                'cuts_removed': cuts_removed,
+                'max_violation': max((g.max_violation for g in generators),
+                                     default=None)}
+
+    def _log_iteration(self, n_iter, master_time, stats):
+        """
+        Append a record of the iteration to `iteration_log` and pass it to
+        the `iteration_callback` option if given. The size of the master
+        problem is updated with the cuts added and removed in the round. In
+        lazy mode the master problem is not re-solved between rounds and
+        the record has no `master_time`.
+        """
+        record = {'iteration': n_iter}
+        if master_time is not None:
+            record['master_time'] = master_time
+        record.update(stats)
+        self._master_size['constraints'] += (stats['cuts_added']
+                                             - stats['cuts_removed'])
+        if self._objective is not None:
+            record['objective'] = value(self._objective, exception=False)
+        record.update(self._master_size)
+        self.iteration_log.append(record)
+        if self._iteration_callback is not None:
+            self._iteration_callback(record)
+
+    def _solve_lazy(self, opt, instance, generators, feasible, subsolver,
+                    subsolver_options, pool, cuts_per_round, max_iter):
+        """
+        Solve the master problem once with the separation problems run from
+        a lazy-constraint callback at every new incumbent, so that robust
+        cuts are added within a single branch-and-cut tree. Requires a
+        persistent solver with callback support (e.g. gurobi_persistent)
+        and a master problem with discrete variables. After `max_iter`
+        separation rounds no more cuts are added. Returns the results and
+        the number of separation rounds.
+        """
+        if not hasattr(opt, 'set_callback'):
+            raise ValueError(
+                    "Lazy constraints require a persistent solver with "
+                    "callback support, e.g. 'gurobi_persistent'.")
+        from gurobipy import GRB
+        opt.set_instance(instance)
+        opt.set_gurobi_param('LazyConstraints', 1)
+        variables = list(instance.component_data_objects(Var))
+        n_iter = [0]
+
+        def callback(cb_m, cb_opt, cb_where):
+            if cb_where == GRB.Callback.MIPSOL and n_iter[0] < max_iter:
+                cb_opt.cbGetSolution(variables)
+                # Cuts stay in the tree, so they cannot be aged
+                stats = self._add_cuts(generators, feasible, cb_opt, True,
+                                       subsolver, subsolver_options, pool,
+                                       None, cuts_per_round, lazy=True)
+                # The master is not re-solved between rounds
+                self._log_iteration(n_iter[0], None, stats)
+                n_iter[0] += 1
+
+        opt.set_callback(callback)
+        results = opt.solve(tee=self._tee, timelimit=self._timelimit)
+        opt.set_callback(None)
+        # Check the final solution
+        for g in generators:
+            feasible[g.name] = g.separate(solver=subsolver,
+                                          options=subsolver_options)
+        return results, n_iter[0]
+
     def _postsolve(self):
         self._instance = None
         return self.results_obj
@@ -138,6 +393,7 @@ class CuttingPlaneSolver(OptSolver):
                 cpu_.append(res.solver.cpu_time)
         if cpu_:
             solv.cpu_time = sum(cpu_)
+        solv.iteration_log = self.iteration_log
         #
         # TODO: detect infeasibilities, etc
         solv.termination_condition = self.termination_condition
@@ -159,3 +415,59 @@ class CuttingPlaneSolver(OptSolver):
         #
         self._instance.solutions.store_to(results)
         return results
+
+
+def _solve_in_pool(pool, generators, worst_case, solver, options):
+    """
+    Solve the separation problems of `generators` which are not yet in
+    `worst_case` and have no closed form in the worker processes of `pool`
+    and add the results to `worst_case`.
+    """
+    options = dict(options)
+    jobs = []
+    for g in generators:
+        res = worst_case.setdefault(g.name, {})
+        for sense, has in ((maximize, g.has_ub()), (minimize, g.has_lb())):
+            if not has or sense in res:
+                continue
+            closed_form = g._worst_case(sense)
+            if closed_form is not None:
+                res[sense] = closed_form
+                continue
+            sep = g.construct_separation_problem(sense, portable=True)
+            jobs.append((res, sense, pool.submit(_solve_separation, sep,
+                                                 solver, options)))
+    for res, sense, job in jobs:
+        res[sense] = job.result()
+
+
+# Solver instances of a worker process, by solver name
+_worker_solvers = {}
+
+
+def _solve_separation(sep, solver, options):
+    """
+    Solve a (portable) separation problem in a worker process and return
+    the objective value and a dict mapping the parameter index to the
+    worst-case value.
+    """
+    if all(sep.coef[i].value == 0 for i in sep.coef):
+        obj = sep.constant.value
+    else:
+        opt = _worker_solvers.get(solver)
+        if opt is None:
+            opt = _worker_solvers[solver] = SolverFactory(solver)
+        for key, val in options.items():
+            opt.options[key] = val
+        if isinstance(opt, PersistentSolver):
+            opt.set_instance(sep)
+            res = opt.solve()
+        else:
+            res = opt.solve(sep)
+        if (res.solver.termination_condition
+                is not TerminationCondition.optimal):
+            raise RuntimeError(
+                    "Solver '{}' failed to solve separation "
+                    "problem.".format(solver))
+        obj = value(sep.obj)
+    return obj, {i: sep.uncparam[i].value for i in sep.uncparam}
@@ -3,6 +3,7 @@ import time
 import pyutilib.misc
 import pyomo.opt
 from pyomo.core import TransformationFactory
+from romodel.reformulate import classify_components
 
 
 @pyomo.opt.SolverFactory.register('romodel.reformulation',
@@ -32,27 +33,34 @@ class ReformulationSolver(pyomo.opt.OptSolver):
         else:
             adjustable = self.options.adjustable
 
+        # Time, generated vars and constraints per transformation
+        self.transformation_profile = {}
         xfrm = TransformationFactory(adjustable)
-        xfrm.apply_to(instance)
+        self._apply_transformation(adjustable, xfrm, instance)
 
         # Reformulate uncertain parameters
         transformations = ['romodel.ellipsoidal',
                            'romodel.polyhedral',
                            'romodel.gp',
-                           'romodel.warpedgp',
-                           'romodel.unknown']
-        transformation_kwargs = {'romodel.ellipsoidal': [],
-                                 'romodel.polyhedral': [],
+                           'romodel.warpedgp']
+        transformation_kwargs = {'romodel.ellipsoidal': ['factor'],
+                                 'romodel.polyhedral': ['batch'],
                                  'romodel.gp': [],
                                  'romodel.warpedgp': ['initialize_wolfe'],
                                  'romodel.unknown': []}
-        for transform in transformations:
-            xfrm = TransformationFactory(transform)
+        xfrms = {t: TransformationFactory(t) for t in transformations}
+        # Assign each uncertain component to a transformation in one pass,
+        # remaining components are handled by 'romodel.unknown'
+        groups = classify_components(instance, list(xfrms.values()))
+        xfrms['romodel.unknown'] = TransformationFactory('romodel.unknown')
+        groups[xfrms['romodel.unknown']] = groups.pop(None)
+        for transform, xfrm in xfrms.items():
             kwargs = {}
             for kw in transformation_kwargs[transform]:
                 if self.options[kw]:
                     kwargs[kw] = self.options[kw]
-            xfrm.apply_to(instance, **kwargs)
+            self._apply_transformation(transform, xfrm, instance,
+                                       components=groups[xfrm], **kwargs)
 
         instance.transformation_time = time.time() - start_time
 
@@ -81,6 +89,20 @@ class ReformulationSolver(pyomo.opt.OptSolver):
 
         # Stuff to represent results in robust model
 
+    def _apply_transformation(self, name, xfrm, instance, **kwargs):
+        """
+        Apply `xfrm` to `instance` and record its total time together with
+        the per component profile collected by the transformation.
+        """
+        start = time.time()
+        xfrm.apply_to(instance, **kwargs)
+        profile = getattr(xfrm, 'profile', {})
+        self.transformation_profile[name] = {
+                'time': time.time() - start,
+                'vars': sum(p['vars'] for p in profile.values()),
+                'constraints': sum(p['constraints'] for p in profile.values()),
+                'components': profile}
+
     def _postsolve(self):
         self._instance = None
         return self.results_obj
@@ -99,6 +121,7 @@ class ReformulationSolver(pyomo.opt.OptSolver):
                 cpu_.append(res.solver.cpu_time)
         if cpu_:
             solv.cpu_time = sum(cpu_)
+        solv.transformation_profile = self.transformation_profile
         #
         # TODO: detect infeasibilities, etc
         solv.termination_condition = self.termination_condition
@@ -3,7 +3,8 @@ import pyomo.environ as pe
 import romodel.examples as ex
 from pyomo.opt import check_available_solvers
 
-solvers = check_available_solvers('gurobi_direct', 'ipopt')
+solvers = check_available_solvers('gurobi_direct', 'gurobi_persistent',
+                                  'ipopt')
 
 
 class TestE2E(unittest.TestCase):
@@ -29,6 +30,108 @@ class TestE2E(unittest.TestCase):
         solver.options['TimeLimit'] = 60
         solver.solve(m, tee=False)
 
+    @unittest.skipIf('gurobi_direct' not in solvers,
+                     'gurobi_direct not available')
+    def test_knapsack_cuts_iteration_log(self):
+        m = ex.Knapsack()
+        records = []
+        solver = pe.SolverFactory('romodel.cuts')
+        solver.options['solver'] = 'gurobi_direct'
+        solver.options['iteration_callback'] = records.append
+        solver.options['TimeLimit'] = 60
+        results = solver.solve(m, tee=False)
+        self.assertEqual(results.solver.iteration_log, records)
+        self.assertEqual(records[-1]['cuts_added'], 0)
+        for key in ['master_time', 'separation_time', 'max_violation',
+                    'objective', 'constraints', 'variables']:
+            self.assertIn(key, records[0])
+        # The master problem grows by the cuts of each round
+        for prev, rec in zip(records, records[1:]):
+            self.assertEqual(rec['constraints'],
+                             prev['constraints'] + rec['cuts_added']
+                             - rec['cuts_removed'])
+        self.assertEqual(records[-1]['constraints'], sum(
+                1 for _ in m.component_data_objects(pe.Constraint,
+                                                    active=True)))
+        self.assertAlmostEqual(records[-1]['objective'], pe.value(m.value))
+
+    @unittest.skipIf('gurobi_persistent' not in solvers,
+                     'gurobi_persistent not available')
+    def test_knapsack_cuts_persistent(self):
+        m = ex.Knapsack()
+        solver = pe.SolverFactory('romodel.cuts')
+        solver.options['solver'] = 'gurobi_persistent'
+        solver.options['TimeLimit'] = 60
+        solver.solve(m, tee=False)
+
+    @unittest.skipIf('gurobi_persistent' not in solvers,
+                     'gurobi_persistent not available')
+    def test_knapsack_cuts_lazy(self):
+        m = ex.Knapsack()
+        solver = pe.SolverFactory('romodel.cuts')
+        solver.options['solver'] = 'gurobi_persistent'
+        solver.options['subsolver'] = 'gurobi_direct'
+        solver.options['lazy'] = True
+        solver.options['TimeLimit'] = 60
+        results = solver.solve(m, tee=False)
+        self.assertAlmostEqual(pe.value(m.value), 19., 6)
+        # The master problem is not re-solved between rounds
+        for record in results.solver.iteration_log:
+            self.assertNotIn('master_time', record)
+        # Continuous master problems fall back to iterative cuts
+        m = ex.Portfolio()
+        solver.solve(m, tee=False)
+        obj = next(m.component_data_objects(pe.Objective, active=True))
+        self.assertAlmostEqual(pe.value(obj), 0.6776393, 4)
+
+    @unittest.skipIf('gurobi_direct' not in solvers,
+                     'gurobi_direct not available')
+    def test_facility_cuts_threads(self):
+        def solve(threads):
+            m = ex.Facility()
+            solver = pe.SolverFactory('romodel.cuts')
+            solver.options['solver'] = 'gurobi_direct'
+            solver.options['separation_threads'] = threads
+            solver.options['TimeLimit'] = 60
+            solver.solve(m, tee=False)
+            tdata = m._transformation_data['romodel.generators']
+            cuts = {g.name: sorted(g._pool) for g in tdata.generators}
+            obj = next(m.component_data_objects(pe.Objective, active=True))
+            return pe.value(obj), cuts
+
+        obj, cuts = solve(4)
+        serial_obj, serial_cuts = solve(1)
+        self.assertAlmostEqual(obj, 572.4, 4)
+        self.assertAlmostEqual(obj, serial_obj, 6)
+        self.assertEqual(cuts, serial_cuts)
+
+    @unittest.skipIf('gurobi_direct' not in solvers,
+                     'gurobi_direct not available')
+    def test_knapsack_cuts_per_round(self):
+        m = ex.Knapsack()
+        m.w.uncset = m.Elib
+        solver = pe.SolverFactory('romodel.cuts')
+        solver.options['solver'] = 'gurobi_direct'
+        solver.options['cuts_per_round'] = 3
+        solver.options['TimeLimit'] = 60
+        with self.assertLogs('romodel.solver.cuts', level='WARNING') as log:
+            solver.solve(m, tee=False)
+        self.assertIn("cuts_per_round=3 cannot be honoured for "
+                      "weight_generator", log.output[0])
+
+        # Adjacent vertices of the general polyhedral set provide extra cuts
+        def solve(cuts_per_round):
+            m = ex.Knapsack()
+            m.w.uncset = m.Plib
+            solver = pe.SolverFactory('romodel.cuts')
+            solver.options['solver'] = 'gurobi_direct'
+            solver.options['cuts_per_round'] = cuts_per_round
+            solver.options['TimeLimit'] = 60
+            solver.solve(m, tee=False)
+            return pe.value(m.value)
+
+        self.assertAlmostEqual(solve(3), solve(1), 6)
+
     @unittest.skipIf('gurobi_direct' not in solvers,
                      'gurobi_direct not available')
     def test_knapsack_cuts_poly_lib(self):
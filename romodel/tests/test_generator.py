@@ -1,7 +1,9 @@
+import pickle
 import pyomo.environ as pe
+import numpy as np
 import pyutilib.th as unittest
 import romodel as ro
-from romodel.generator import generate_linear_repn
+from romodel.generator import generate_linear_repn, batch_worst_case
 from pyomo.repn import generate_standard_repn
 
 
@@ -61,3 +63,215 @@ class TestGenerator(unittest.TestCase):
         sep = m.rc.construct_separation_problem()
         repn = generate_standard_repn(sep.obj)
         self.assertEqual(repn.linear_coefs, (0.8, 0.8))
+
+    def test_separation_problem_reused(self):
+        m = pe.ConcreteModel()
+        m.x = pe.Var([0, 1])
+        m.U = ro.UncSet()
+        m.w = ro.UncParam([0, 1], nominal=(0.5, 0.5), uncset=m.U)
+        m.U.c0 = pe.Constraint(expr=m.w[0] <= 1)
+        m.U.c1 = pe.Constraint(expr=m.w[1] <= 1)
+        for i in m.x:
+            m.x[i].value = 0.8
+        m.c = pe.Constraint(expr=m.x[0]*m.w[0] + m.x[1]*m.w[1] >= 1)
+
+        m.rc = ro.RobustConstraint()
+        m.rc.build(m.c.lower, m.c.body, m.c.upper)
+
+        sep = m.rc.construct_separation_problem(sense=pe.minimize)
+        self.assertEqual(sep.obj.sense, pe.minimize)
+        # Only the coefficients and sense change between iterations
+        m.x[0].value = 0.3
+        sep2 = m.rc.construct_separation_problem()
+        self.assertIs(sep, sep2)
+        self.assertEqual(sep.obj.sense, pe.maximize)
+        repn = generate_standard_repn(sep.obj)
+        self.assertEqual(repn.linear_coefs, (0.3, 0.8))
+
+    def test_portable_separation_problem(self):
+        m = pe.ConcreteModel()
+        m.x = pe.Var([0, 1])
+        m.p = pe.Param(initialize=2, mutable=True)
+        m.U = ro.UncSet()
+        m.w = ro.UncParam([0, 1], nominal=(0.5, 0.5), uncset=m.U)
+        m.U.c0 = pe.Constraint(expr=m.p*m.w[0] <= 1)
+        m.U.c1 = pe.Constraint(expr=m.w[1] <= m.p)
+        for i in m.x:
+            m.x[i].value = 0.8
+        m.c = pe.Constraint(expr=m.x[0]*m.w[0] + m.x[1]*m.w[1] <= 1)
+
+        m.rc = ro.RobustConstraint()
+        m.rc.build(m.c.lower, m.c.body, m.c.upper)
+        sep = m.rc.construct_separation_problem(portable=True)
+        self.assertIsNot(sep, m.rc.construct_separation_problem())
+        # Params of the uncertainty set are replaced by their values, the
+        # model can be pickled without the original model
+        sep = pickle.loads(pickle.dumps(sep))
+        repn = generate_standard_repn(sep.cons[1].body)
+        self.assertEqual(repn.linear_coefs, (2,))
+        self.assertEqual(sep.cons[2].upper, 2)
+        self.assertEqual(pe.value(sep.coef[0]), 0.8)
+
+    def test_worst_case_ellipsoidal(self):
+        m = pe.ConcreteModel()
+        m.x = pe.Var([0, 1])
+        m.U = ro.uncset.EllipsoidalSet([1, 2], [[4, 0], [0, 1]])
+        m.w = ro.UncParam([0, 1], nominal=(1, 2), uncset=m.U)
+        m.x[0].value = 1
+        m.x[1].value = 0
+        m.c = pe.Constraint(expr=m.x[0]*m.w[0] + m.x[1]*m.w[1] <= 1)
+
+        m.rc = ro.RobustConstraint()
+        m.rc.build(m.c.lower, m.c.body, m.c.upper)
+
+        obj, point = m.rc._worst_case(pe.maximize)
+        self.assertAlmostEqual(obj, 3)
+        self.assertAlmostEqual(point[0], 3)
+        self.assertAlmostEqual(point[1], 2)
+        obj, point = m.rc._worst_case(pe.minimize)
+        self.assertAlmostEqual(obj, -1)
+
+    def test_worst_case_box(self):
+        m = pe.ConcreteModel()
+        m.x = pe.Var([0, 1])
+        m.P = ro.uncset.PolyhedralSet([[1, 0], [0, 1], [-1, 0], [0, -1]],
+                                      [1, 2, 0, 1])
+        m.w = ro.UncParam([0, 1], nominal=(0.5, 0.5), uncset=m.P)
+        m.x[0].value = 1
+        m.x[1].value = -1
+        m.c = pe.Constraint(expr=m.x[0]*m.w[0] + m.x[1]*m.w[1] <= 1)
+
+        m.rc = ro.RobustConstraint()
+        m.rc.build(m.c.lower, m.c.body, m.c.upper)
+
+        obj, point = m.rc._worst_case(pe.maximize)
+        self.assertEqual(point, {0: 1, 1: -1})
+        self.assertAlmostEqual(obj, 2)
+
+        m.Q = ro.uncset.PolyhedralSet([[1, 1]], [1])
+        self.assertIsNone(m.Q.box)
+
+    def test_batch_worst_case(self):
+        m = pe.ConcreteModel()
+        m.x = pe.Var([0, 1])
+        m.U = ro.uncset.EllipsoidalSet([1, 2], [[2, 1], [1, 2]])
+        m.w = ro.UncParam([0, 1], nominal=(1, 2), uncset=m.U)
+        m.x[0].value = 1
+        m.x[1].value = -2
+        m.c1 = pe.Constraint(expr=m.x[0]*m.w[0] + m.x[1]*m.w[1] <= 1)
+        m.c2 = pe.Constraint(expr=(-1, m.x[1]*m.w[0] + m.w[1], 1))
+
+        m.rc1 = ro.RobustConstraint()
+        m.rc1.build(m.c1.lower, m.c1.body, m.c1.upper)
+        m.rc2 = ro.RobustConstraint()
+        m.rc2.build(m.c2.lower, m.c2.body, m.c2.upper)
+
+        res = batch_worst_case([m.rc1, m.rc2])
+        self.assertEqual(set(res[m.rc1.name]), set([pe.maximize]))
+        self.assertEqual(set(res[m.rc2.name]),
+                         set([pe.maximize, pe.minimize]))
+        for rc in [m.rc1, m.rc2]:
+            for sense, (obj, point) in res[rc.name].items():
+                obj_ref, point_ref = rc._worst_case(sense)
+                self.assertAlmostEqual(obj, obj_ref)
+                for i in point:
+                    self.assertAlmostEqual(point[i], point_ref[i])
+
+    def test_cut_pool(self):
+        m = pe.ConcreteModel()
+        m.x = pe.Var([0, 1])
+        m.U = ro.uncset.EllipsoidalSet([1, 2], [[1, 0], [0, 1]])
+        m.w = ro.UncParam([0, 1], nominal=(1, 2), uncset=m.U)
+        m.x[0].value = 1
+        m.x[1].value = 0
+        m.c = pe.Constraint(expr=m.x[0]*m.w[0] + m.x[1]*m.w[1] <= 1)
+
+        m.rc = ro.RobustConstraint()
+        m.rc.build(m.c.lower, m.c.body, m.c.upper)
+
+        self.assertFalse(m.rc.separate())
+        self.assertEqual(len(m.rc.add_violated_cuts()), 1)
+        # Same scenario again is skipped
+        self.assertFalse(m.rc.separate())
+        self.assertEqual(len(m.rc.add_violated_cuts()), 0)
+        self.assertEqual(m.rc.pool_stats()['duplicates'], 1)
+        # Cut is slack at a new point and is deactivated
+        m.x[0].value = 0
+        self.assertTrue(m.rc.separate())
+        m.rc.add_violated_cuts(max_age=1)
+        self.assertEqual(len(m.rc.removed_cuts), 1)
+        stats = m.rc.pool_stats()
+        self.assertEqual(stats['cuts'], 1)
+        self.assertEqual(stats['active'], 0)
+        # Violated again, the cut is reactivated
+        m.x[0].value = 1
+        self.assertFalse(m.rc.separate())
+        self.assertEqual(len(m.rc.add_violated_cuts()), 1)
+        self.assertEqual(m.rc.pool_stats()['reactivated'], 1)
+
+    def test_multiple_cuts(self):
+        m = pe.ConcreteModel()
+        m.x = pe.Var([0, 1, 2])
+        m.P = ro.uncset.PolyhedralSet([[1, 0, 0], [0, 1, 0], [0, 0, 1],
+                                       [-1, 0, 0], [0, -1, 0], [0, 0, -1]],
+                                      [1, 1, 1, 0, 0, 0])
+        m.w = ro.UncParam([0, 1, 2], nominal=(0.5, 0.5, 0.5), uncset=m.P)
+        m.x[0].value = 3
+        m.x[1].value = 2
+        m.x[2].value = 1
+        m.c = pe.Constraint(expr=sum(m.x[i]*m.w[i] for i in m.x) <= 2)
+
+        m.rc = ro.RobustConstraint()
+        m.rc.build(m.c.lower, m.c.body, m.c.upper)
+
+        self.assertFalse(m.rc.separate(max_cuts=3))
+        cuts = m.rc.add_violated_cuts()
+        # Worst-case vertex (1, 1, 1) and neighbours (1, 1, 0), (1, 0, 1)
+        self.assertEqual(len(cuts), 3)
+        self.assertTrue(m.rc.supports_multiple_cuts())
+        # Only the worst case for an ellipsoidal set
+        m.E = ro.uncset.EllipsoidalSet([0.5, 0.5, 0.5], np.eye(3))
+        m.w.uncset = m.E
+        m.rc2 = ro.RobustConstraint()
+        m.rc2.build(m.c.lower, m.c.body, m.c.upper)
+        self.assertFalse(m.rc2.supports_multiple_cuts())
+
+    def test_multiple_cuts_polyhedral(self):
+        m = pe.ConcreteModel()
+        m.x = pe.Var([0, 1, 2])
+        m.U = ro.UncSet()
+        m.w = ro.UncParam([0, 1, 2], nominal=(0.5, 0.5, 0.5), uncset=m.U)
+        m.U.cons = pe.ConstraintList()
+        m.U.cons.add(sum(m.w[i] for i in m.w) <= 2.5)
+        for i in m.w:
+            m.U.cons.add(pe.inequality(0, m.w[i], 1))
+        m.x[0].value = 3
+        m.x[1].value = 2
+        m.x[2].value = 1
+        m.c = pe.Constraint(expr=sum(m.x[i]*m.w[i] for i in m.x) <= 2)
+
+        m.rc = ro.RobustConstraint()
+        m.rc.build(m.c.lower, m.c.body, m.c.upper)
+        self.assertTrue(m.rc.supports_multiple_cuts())
+
+        worst_case = {pe.maximize: (5.5, {0: 1., 1: 1., 2: 0.5})}
+        self.assertFalse(m.rc.separate(worst_case=worst_case, max_cuts=3))
+        # Worst-case vertex and the adjacent vertices (1, 1, 0), (1, 0.5, 1)
+        points = set(tuple(round(p[i], 6) for i in range(3))
+                     for p in m.rc._cut_points)
+        self.assertEqual(points, {(1, 1, 0.5), (1, 1, 0), (1, 0.5, 1)})
+        cuts = m.rc.add_violated_cuts()
+        self.assertEqual(len(cuts), 3)
+        # Same result for the library set
+        m.P = ro.uncset.PolyhedralSet([[1, 1, 1], [1, 0, 0], [0, 1, 0],
+                                       [0, 0, 1], [-1, 0, 0], [0, -1, 0],
+                                       [0, 0, -1]],
+                                      [2.5, 1, 1, 1, 0, 0, 0])
+        m.w.uncset = m.P
+        m.rc2 = ro.RobustConstraint()
+        m.rc2.build(m.c.lower, m.c.body, m.c.upper)
+        self.assertTrue(m.rc2.supports_multiple_cuts())
+        self.assertFalse(m.rc2.separate(worst_case=worst_case, max_cuts=3))
+        points = set(tuple(round(p[i], 6) for i in range(3))
+                     for p in m.rc2._cut_points)
+        self.assertEqual(points, {(1, 1, 0.5), (1, 1, 0), (1, 0.5, 1)})
@@ -6,6 +6,7 @@ from romodel.reformulate import (EllipsoidalTransformation,
                                  PolyhedralTransformation)
 from pyomo.opt import check_available_solvers
 from pyomo.repn import generate_standard_repn
+import numpy as np
 
 solvers = check_available_solvers('gurobi_direct')
 
@@ -37,6 +38,62 @@ class TestReformulation(unittest.TestCase):
         solver.solve(m)
         self.assertEqual(m.value(), 19.)
 
+    @unittest.skipIf('gurobi_direct' not in solvers,
+                     'gurobi_direct not available')
+    def test_polyhedral_batch(self):
+        m = romodel.examples.Knapsack()
+        m.w.uncset = m.P
+        t = PolyhedralTransformation()
+        t.apply_to(m, batch=True)
+        self.assertTrue(hasattr(m, 'P_dual'))
+        solver = pe.SolverFactory('gurobi_direct')
+        solver.solve(m)
+        self.assertEqual(m.value(), 19.)
+
+    @unittest.skipIf('gurobi_direct' not in solvers,
+                     'gurobi_direct not available')
+    def test_polyhedral_pao(self):
+        m = romodel.examples.Knapsack()
+        m.w.uncset = m.P
+        t = PolyhedralTransformation()
+        t.apply_to(m, pao=True)
+        dual = m.weight_counterpart.upper
+        # One dual variable per constraint of P, one dual constraint per w
+        self.assertEqual(len(dual.var), len(dual.var_keys))
+        self.assertEqual(len(dual.cons), len(m.w))
+        self.assertEqual(sorted(ndx for _, ndx in dual.con_keys),
+                         sorted(m.w))
+        solver = pe.SolverFactory('gurobi_direct')
+        solver.solve(m)
+        self.assertEqual(m.value(), 19.)
+
+    def test_polyhedral_batch_shared_uncset(self):
+        m = pe.ConcreteModel()
+        m.x = pe.Var(range(2))
+        m.P = ro.uncset.PolyhedralSet([[1, 0], [0, 1], [-1, 0], [0, -1]],
+                                      [1.5, 2.5, -0.5, -1.5])
+        m.w = ro.UncParam(range(2), nominal=(1, 2), uncset=m.P)
+        expr = pe.sum_product(m.w, m.x)
+        m.c1 = pe.Constraint(expr=expr <= 2)
+        m.c2 = pe.Constraint(expr=pe.inequality(-1, expr, 3))
+        m.obj = pe.Objective(expr=m.x[0], sense=pe.maximize)
+        t = ro.PolyhedralTransformation()
+        t.apply_to(m, batch=True)
+        self.assertFalse(m.c1.active)
+        self.assertFalse(m.c2.active)
+        # No (empty) per-constraint counterparts
+        self.assertFalse(hasattr(m, 'c1_counterpart'))
+        self.assertFalse(hasattr(m, 'c2_counterpart'))
+        # One block with three duals: c1 upper, c2 upper and c2 lower. The
+        # upper bounds have identical coefficients and share dual variables
+        self.assertEqual(len(m.P_dual.obj), 3)
+        self.assertEqual(len(m.P_dual.cons), 4)
+        self.assertEqual(len(m.P_dual.var), 8)
+        repn = generate_standard_repn(m.P_dual.obj['c1', 'upper'].body)
+        self.assertEqual(repn.linear_coefs, (1.5, 2.5, -0.5, -1.5))
+        repn2 = generate_standard_repn(m.P_dual.obj['c2', 'upper'].body)
+        self.assertEqual(repn2.linear_vars, repn.linear_vars)
+
     def test_polyhedral_cons_lb(self):
         m = pe.ConcreteModel()
         m.x = pe.Var(range(2))
@@ -73,6 +130,27 @@ class TestReformulation(unittest.TestCase):
         self.assertTrue(hasattr(m, 'cons_counterpart'))
         self.assertTrue(hasattr(m.cons_counterpart, 'upper'))
 
+    def test_polyhedral_param_rhs(self):
+        m = pe.ConcreteModel()
+        m.x = pe.Var(range(2))
+        m.p = pe.Param(initialize=1.5, mutable=True)
+        m.U = ro.UncSet()
+        m.w = ro.UncParam(range(2), nominal=(1, 2), uncset=m.U)
+        m.U.c0 = pe.Constraint(expr=m.w[0] <= m.p)
+        m.U.c1 = pe.Constraint(expr=m.w[1] <= 2.5)
+        m.U.c2 = pe.Constraint(expr=0 <= m.w[0])
+
+        m.cons = pe.Constraint(expr=pe.sum_product(m.w, m.x) <= 2)
+        t = ro.PolyhedralTransformation()
+        t.apply_to(m)
+        # The symbolic rhs is kept, the zero rhs of c2 is skipped
+        repn = generate_standard_repn(m.cons_counterpart.upper.obj.body,
+                                      compute_values=False)
+        self.assertEqual(len(repn.linear_vars), 2)
+        m.p = 0.5
+        self.assertEqual(sorted(pe.value(c) for c in repn.linear_coefs),
+                         [0.5, 2.5])
+
     def test_polyhedral_obj_min(self):
         m = pe.ConcreteModel()
         m.x = pe.Var(range(2))
@@ -141,6 +219,17 @@ class TestReformulation(unittest.TestCase):
         solver.solve(m)
         self.assertEqual(m.value(), 19.)
 
+    def test_transformation_profile(self):
+        m = romodel.examples.Knapsack()
+        m.w.uncset = m.Elib
+        t = EllipsoidalTransformation()
+        t.apply_to(m)
+        self.assertEqual(list(t.profile), ['weight'])
+        profile = t.profile['weight']
+        self.assertGreaterEqual(profile['time'], 0)
+        self.assertEqual(profile['vars'], 1)
+        self.assertEqual(profile['constraints'], 2)
+
     def test_ellipsoidal_cons_lb(self):
         m = pe.ConcreteModel()
         m.x = pe.Var(range(2))
@@ -378,6 +467,301 @@ class TestReformulation(unittest.TestCase):
         self.assertEqual(repn.linear_coefs, (1, -1))
         self.assertEqual(repn.linear_vars, (blk.var[1], blk.var[3]))
 
+    def test_create_linear_dual_from_matrix_repn(self):
+        import scipy.sparse
+        from romodel.duality import create_linear_dual_from_matrix_repn
+        c = np.array([[0.5, 0.7], [1., 0.]])
+        b = [0.1, 0.2]
+        P = scipy.sparse.csr_matrix([[1, 0], [0, 1], [-1, 0], [0, -1]])
+        d = np.array([1.2, 1.3, 0.9, 0.8])
+        keys = [('a',), ('b',)]
+        blk = create_linear_dual_from_matrix_repn(c, b, P, d, keys=keys)
+        self.assertEqual(len(blk.var), 8)
+        self.assertEqual(len(blk.obj), 2)
+        self.assertEqual(len(blk.cons), 4)
+        repn = generate_standard_repn(blk.obj['b'].body)
+        self.assertEqual(repn.linear_coefs, (1.2, 1.3, 0.9, 0.8))
+        self.assertEqual(blk.obj['b'].upper, 0.2)
+        repn = generate_standard_repn(blk.cons['b', 0].body)
+        self.assertEqual(repn.linear_coefs, (1, -1))
+        self.assertEqual(repn.linear_vars, (blk.var['b', 0], blk.var['b', 2]))
+        self.assertEqual(blk.cons['b', 0].upper, 1.)
+
+    def test_polyhedral_cache(self):
+        m = pe.ConcreteModel()
+        m.P = ro.UncSet()
+        m.w = ro.UncParam(range(2), nominal=(1, 2), uncset=m.P)
+        m.P.cons = pe.ConstraintList()
+        m.P.cons.add(pe.inequality(0.5, m.w[0], 1.5))
+        m.P.cons.add(pe.inequality(1.5, m.w[1], 2.5))
+        t = PolyhedralTransformation()
+        self.assertTrue(t._check_applicability(m.P))
+        mat = m.P.mat
+        self.assertEqual(mat.shape, (4, 2))
+        # Unchanged set reuses extracted matrix
+        self.assertTrue(t._check_applicability(m.P))
+        self.assertIs(m.P.mat, mat)
+        # Adding a constraint invalidates the cache
+        m.P.cons.add(m.w[0] + m.w[1] <= 3.5)
+        self.assertTrue(t._check_applicability(m.P))
+        self.assertEqual(m.P.mat.shape, (5, 2))
+        # Deactivating a constraint invalidates the cache
+        m.P.cons[3].deactivate()
+        self.assertTrue(t._check_applicability(m.P))
+        self.assertEqual(m.P.mat.shape, (4, 2))
+        # Applicability result is cached as well
+        m.P.cons.add(m.w[0]**2 <= 3)
+        self.assertFalse(t._check_applicability(m.P))
+        self.assertFalse(t._check_applicability(m.P))
+        m.P.cons[4].deactivate()
+        self.assertTrue(t._check_applicability(m.P))
+        # Changing a mutable Param in the set invalidates the cache
+        m.p = pe.Param(initialize=2.5, mutable=True)
+        m.P.cons.add(m.p*m.w[1] <= 3)
+        self.assertTrue(t._check_applicability(m.P))
+        self.assertEqual(m.P.mat[-1, 1], 2.5)
+        m.p = 3
+        self.assertTrue(t._check_applicability(m.P))
+        self.assertEqual(m.P.mat[-1, 1], 3)
+
+    def test_classify_components(self):
+        m = romodel.examples.Knapsack()
+        m.w.uncset = m.Plib
+        ell = EllipsoidalTransformation()
+        poly = PolyhedralTransformation()
+        groups = ro.reformulate.classify_components(m, [ell, poly])
+        self.assertEqual(groups[ell], [])
+        self.assertEqual(groups[None], [])
+        self.assertEqual([c for c, _, _ in groups[poly]], [m.weight])
+        c, param, uncset = groups[poly][0]
+        self.assertIs(param, m.w)
+        self.assertIs(uncset, m.Plib)
+
+    def test_polyhedral_lib_sparse(self):
+        P = ro.uncset.PolyhedralSet([[1, 0, 0], [0, 2, 0], [0, 0, 0]],
+                                    [1, 2, 3])
+        self.assertEqual(P.mat.nnz, 2)
+        m = pe.ConcreteModel()
+        m.w = pe.Var(range(3))
+        cons = list(P.generate_cons_from_lib(m.w))
+        # Empty rows are skipped
+        self.assertEqual(len(cons), 2)
+        repn = generate_standard_repn(cons[1][1])
+        self.assertEqual(repn.linear_coefs, (2, ))
+        self.assertEqual(repn.linear_vars, (m.w[1], ))
+        # An empty row with negative right-hand side makes the set empty
+        P = ro.uncset.PolyhedralSet([[1, 0], [0, 0]], [1, -1])
+        with self.assertRaises(RuntimeError):
+            list(P.generate_cons_from_lib(m.w))
+
+    @unittest.skipIf('gurobi_direct' not in solvers,
+                     'gurobi_direct not available')
+    def test_ellipsoidal_factor(self):
+        m = romodel.examples.Knapsack()
+        m.w.uncset = m.Elib
+        t = EllipsoidalTransformation()
+        t.apply_to(m, factor=True)
+        self.assertTrue(hasattr(m.weight_counterpart, 'aux'))
+        solver = pe.SolverFactory('gurobi_direct')
+        solver.options['NonConvex'] = 2
+        solver.solve(m)
+        self.assertEqual(m.value(), 19.)
+
+    def test_ellipsoidal_padding(self):
+        def build():
+            m = pe.ConcreteModel()
+            m.x = pe.Var(range(3))
+            m.D = ro.uncset.EllipsoidalSet([1, 2, 3], [[1, 0, 0],
+                                                       [0, 2, 0],
+                                                       [0, 0, 3]])
+            m.E = ro.uncset.EllipsoidalSet([1, 2, 3], [[2, 1, 0],
+                                                       [1, 2, 0],
+                                                       [0, 0, 1]])
+            m.w = ro.UncParam(range(3), nominal=(1, 2, 3), uncset=m.D)
+            m.v = ro.UncParam(range(3), nominal=(1, 2, 3), uncset=m.E)
+            m.c1 = pe.Constraint(expr=m.w[0]*m.x[0] + m.w[1]*m.x[1] <= 1)
+            m.c2 = pe.Constraint(expr=pe.sum_product(m.v, m.x) <= 1)
+            return m
+
+        m = build()
+        EllipsoidalTransformation().apply_to(m)
+        # Diagonal covariance: only squares of nonzero coefficients
+        repn = generate_standard_repn(m.c1_counterpart.upper.det.body)
+        self.assertEqual(len(repn.quadratic_vars), 3)
+        # Sparse covariance: zero entries are skipped
+        repn = generate_standard_repn(m.c2_counterpart.upper.det.body)
+        self.assertEqual(len(repn.quadratic_vars), 5)
+        self.assertFalse(hasattr(m.c2_counterpart, 'aux'))
+
+        # Factored form: padding = sum of squares of auxiliary variables
+        m = build()
+        EllipsoidalTransformation().apply_to(m, factor=True)
+        self.assertEqual(len(m.c2_counterpart.aux), 3)
+        self.assertEqual(len(m.c2_counterpart.aux_def), 3)
+        repn = generate_standard_repn(m.c2_counterpart.upper.det.body)
+        self.assertEqual(len(repn.quadratic_vars), 4)
+        self.assertEqual(len(repn.linear_vars), 0)
+        # Diagonal covariance with expression coefficients: aux = L^T * x
+        # with L = diag(sqrt(cov_ii)), only for the nonzero coefficients
+        self.assertEqual(len(m.c1_counterpart.aux), 2)
+        m = build()
+        m.c3 = pe.Constraint(expr=(m.x[0] + m.x[1])*m.w[0]
+                             + 2*m.x[2]*m.w[2] <= 1)
+        EllipsoidalTransformation().apply_to(m, factor=True)
+        cp = m.c3_counterpart
+        self.assertEqual(list(cp.aux), [0, 2])
+        repn = generate_standard_repn(cp.aux_def[2].body)
+        coefs = {id(v): c for v, c in zip(repn.linear_vars,
+                                          repn.linear_coefs)}
+        self.assertAlmostEqual(abs(coefs[id(m.x[2])]), 2*np.sqrt(3))
+        repn = generate_standard_repn(cp.upper.det.body)
+        self.assertEqual(sorted(id(v) for v, _ in repn.quadratic_vars),
+                         sorted([id(cp.aux[0]), id(cp.aux[2]),
+                                 id(cp.upper.padding)]))
+
+    @unittest.skipIf('gurobi_direct' not in solvers,
+                     'gurobi_direct not available')
+    def test_ellipsoidal_factor_socp(self):
+        m = romodel.examples.Knapsack()
+        m.w.uncset = m.Elib
+        t = EllipsoidalTransformation()
+        t.apply_to(m, factor=True)
+        # sum_k aux_k^2 <= padding^2 is solved as a second-order cone
+        # without NonConvex
+        solver = pe.SolverFactory('gurobi_direct')
+        solver.solve(m)
+        self.assertEqual(m.value(), 19.)
+
+    def test_shared_counterparts(self):
+        def build():
+            m = pe.ConcreteModel()
+            m.x = pe.Var(range(2))
+            m.P = ro.uncset.PolyhedralSet([[1, 0], [0, 1], [-1, 0], [0, -1]],
+                                          [1.5, 2.5, -0.5, -1.5])
+            m.E = ro.uncset.EllipsoidalSet([1, 2], [[2, 1], [1, 2]])
+            m.w = ro.UncParam(range(2), nominal=(1, 2), uncset=m.P)
+            m.v = ro.UncParam(range(2), nominal=(1, 2), uncset=m.E)
+            m.c = pe.Constraint(range(3), rule=lambda m, t:
+                                pe.sum_product(m.w, m.x) <= t)
+            m.d = pe.Constraint(range(3), rule=lambda m, t:
+                                pe.sum_product(m.v, m.x) <= t)
+            return m
+
+        m = build()
+        PolyhedralTransformation().apply_to(m)
+        EllipsoidalTransformation().apply_to(m)
+
+        def cp(name, t):
+            return getattr(m, '{}[{}]_counterpart'.format(name, t))
+        # Dual variables and padding are created once
+        self.assertTrue(hasattr(cp('c', 0).upper, 'var'))
+        self.assertTrue(hasattr(cp('d', 0).upper, 'padding'))
+        for t in (1, 2):
+            self.assertFalse(hasattr(cp('c', t).upper, 'var'))
+            self.assertFalse(hasattr(cp('d', t).upper, 'padding'))
+            self.assertEqual(pe.value(cp('c', t).upper.obj.upper), t)
+        nvars = len(list(m.component_data_objects(pe.Var)))
+        self.assertEqual(nvars, 2 + 4 + 1)
+
+        m = build()
+        PolyhedralTransformation().apply_to(m, share=False)
+        EllipsoidalTransformation().apply_to(m, share=False)
+        nvars = len(list(m.component_data_objects(pe.Var)))
+        self.assertEqual(nvars, 2 + 3*4 + 3)
+
+    def test_ellipsoidal_factor_ranged(self):
+        for share in (True, False):
+            m = pe.ConcreteModel()
+            m.x = pe.Var(range(2))
+            m.U = ro.uncset.EllipsoidalSet([1, 2], [[2, 1], [1, 2]])
+            m.w = ro.UncParam(range(2), nominal=(1, 2), uncset=m.U)
+            expr = m.w[0]*m.x[0] + m.w[1]*m.x[1]
+            m.c = pe.Constraint(expr=pe.inequality(-1, expr, 3))
+            EllipsoidalTransformation().apply_to(m, factor=True, share=share)
+            # Auxiliary variables are created once for both bounds
+            cp = m.c_counterpart
+            self.assertEqual(len(cp.aux), 2)
+            self.assertEqual(len(cp.aux_def), 2)
+            self.assertTrue(hasattr(cp.upper, 'padding'))
+            self.assertEqual(hasattr(cp.lower, 'padding'), not share)
+
+    def test_ellipsoidal_factorization(self):
+        cov = [[2, 1, 0], [1, 2, 0], [0, 0, 1]]
+        E = ro.uncset.EllipsoidalSet([1, 2, 3], cov)
+        self.assertTrue(np.allclose(E.factor.dot(E.factor.T), cov))
+        self.assertTrue(np.allclose(E.invcov, np.linalg.inv(cov)))
+        m = pe.ConcreteModel()
+        m.w = pe.Var(range(3))
+        _, expr, rhs = next(E.generate_cons_from_lib(m.w))
+        repn = generate_standard_repn(expr)
+        # Zero entries of the inverse are skipped
+        self.assertEqual(len(repn.quadratic_vars), 4)
+        # Factor and inverse follow a new covariance
+        E.cov = [[1, 0, 0], [0, 4, 0], [0, 0, 1]]
+        self.assertTrue(np.allclose(E.factor, np.diag([1, 2, 1])))
+        self.assertTrue(np.allclose(E.invcov, np.diag([1, 0.25, 1])))
+        # Rank deficient covariance: the ellipsoid is restricted to the
+        # range of the factor by equality constraints
+        E = ro.uncset.EllipsoidalSet([1, 2], [[1, 1], [1, 1]])
+        self.assertEqual(E.factor.shape, (2, 1))
+        self.assertTrue(np.allclose(E.invcov, np.linalg.pinv([[1, 1],
+                                                              [1, 1]])))
+        m = pe.ConcreteModel()
+        m.w = pe.Var(range(2))
+        cons = list(E.generate_cons_from_lib(m.w))
+        self.assertEqual(len(cons), 2)
+        lower, expr, upper = cons[1]
+        self.assertEqual((lower, upper), (0, 0))
+        repn = generate_standard_repn(expr)
+        self.assertAlmostEqual(abs(repn.linear_coefs[0]), np.sqrt(0.5))
+        self.assertAlmostEqual(sum(repn.linear_coefs), 0)
+
+    @unittest.skipIf('gurobi_direct' not in solvers,
+                     'gurobi_direct not available')
+    def test_ellipsoidal_rank_deficient_separation(self):
+        # The separation problem agrees with the closed form worst case
+        m = pe.ConcreteModel()
+        m.x = pe.Var(range(2), initialize=1)
+        m.U = ro.uncset.EllipsoidalSet([1, 2], [[1, 1], [1, 1]])
+        m.w = ro.UncParam(range(2), nominal=(1, 2), uncset=m.U)
+        m.x[0].value = 2
+        m.c = pe.Constraint(expr=m.w[0]*m.x[0] + m.w[1]*m.x[1] <= 10)
+        pe.TransformationFactory('romodel.generators').apply_to(m)
+        g = m._transformation_data['romodel.generators'].generators[0]
+        g.opt = pe.SolverFactory('gurobi_direct')
+        g.opt.options['NonConvex'] = 2
+        g._opt_loaded = False
+        obj, point = g._solve_separation_problem(pe.maximize)
+        worst = m.U.worst_case([2, 1], pe.maximize)
+        self.assertAlmostEqual(point[0], worst[0], 4)
+        self.assertAlmostEqual(point[1], worst[1], 4)
+
+    def test_ellipsoidal_generic_factorization(self):
+        m = pe.ConcreteModel()
+        m.U = ro.UncSet()
+        m.w = ro.UncParam(range(2), nominal=(1, 2), uncset=m.U)
+        A = [[2, 0.5], [0.5, 1]]
+        expr = sum((m.w[i] - i - 1)*A[i][j]*(m.w[j] - j - 1)
+                   for i in range(2) for j in range(2))
+        m.U.cons = pe.Constraint(expr=expr <= 1)
+        t = EllipsoidalTransformation()
+        self.assertTrue(t._check_applicability(m.U))
+        self.assertTrue(np.allclose(m.U.cov, np.linalg.inv(A)))
+        self.assertTrue(np.allclose(m.U.factor.dot(m.U.factor.T),
+                                    np.linalg.inv(A)))
+        self.assertAlmostEqual(m.U.mean[0], 1)
+        self.assertAlmostEqual(m.U.mean[1], 2)
+        # Same set written as a lower bound
+        m.U.cons.deactivate()
+        m.U.cons_lb = pe.Constraint(expr=-expr >= -1)
+        self.assertTrue(t._check_applicability(m.U))
+        self.assertTrue(np.allclose(m.U.cov, np.linalg.inv(A)))
+        self.assertAlmostEqual(m.U.mean[1], 2)
+        # Indefinite quadratic is not ellipsoidal
+        m.U.cons_lb.deactivate()
+        m.U.cons_indef = pe.Constraint(expr=m.w[0]**2 - m.w[1]**2 <= 1)
+        self.assertFalse(t._check_applicability(m.U))
+
 
 if __name__ == "__main__":
     unittest.main()
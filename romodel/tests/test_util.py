@@ -1,7 +1,13 @@
 import pyutilib.th as unittest
 import pyomo.environ as pe
 import romodel as ro
-from romodel.util import collect_uncparam
+from pyomo.core.expr.numeric_expr import LinearExpression
+from romodel.util import collect_uncparam, generate_repn_param
+from romodel.visitor import (component_parents,
+                             component_is_uncertain,
+                             component_is_adjustable,
+                             analyze_expression,
+                             analyze_component)
 
 
 class TestUtil(unittest.TestCase):
@@ -14,3 +20,98 @@ class TestUtil(unittest.TestCase):
         m.o = pe.Objective(expr=m.x**2 + pe.sin(m.u[0]))
         self.assertIs(collect_uncparam(m.c), m.w)
         self.assertIs(collect_uncparam(m.o), m.u)
+
+    def test_component_parents_cached(self):
+        m = pe.ConcreteModel()
+        m.w = ro.UncParam()
+        m.u = ro.UncParam(range(2))
+        m.y = ro.AdjustableVar()
+        m.x = pe.Var()
+        m.c = pe.Constraint(expr=3*m.x + 4*m.w*m.y <= 1)
+        parents = component_parents(m.c)
+        self.assertEqual(parents[ro.UncParam], [m.w])
+        self.assertEqual(parents[ro.AdjustableVar], [m.y])
+        self.assertTrue(component_is_uncertain(m.c))
+        self.assertTrue(component_is_adjustable(m.c))
+        # Same expression, cached result
+        self.assertIs(component_parents(m.c), parents)
+        # New expression invalidates the cache
+        m.c.set_value(m.x + m.u[0] <= 1)
+        self.assertIs(collect_uncparam(m.c), m.u)
+        self.assertFalse(component_is_adjustable(m.c))
+
+    def test_generate_repn_param(self):
+        m = pe.ConcreteModel()
+        m.w = ro.UncParam(range(2), nominal=(1, 2))
+        m.x = pe.Var(range(2))
+        m.y = pe.Var()
+        m.z = pe.Var()
+        m.y.fix(3)
+        expr = m.x[0]*m.w[0] + m.x[1]*m.w[1] + m.y + m.z
+        repn = generate_repn_param(expr)
+        self.assertTrue(repn.is_linear())
+        self.assertEqual(set(id(v) for v in repn.linear_vars),
+                         set(id(m.w[i]) for i in m.w))
+        self.assertEqual(set(id(c) for c in repn.linear_coefs),
+                         set(id(m.x[i]) for i in m.x))
+        # Fixed state of all variables is restored
+        self.assertFalse(m.x[0].fixed)
+        self.assertFalse(m.x[1].fixed)
+        self.assertFalse(m.z.fixed)
+        self.assertTrue(m.y.fixed)
+
+    def test_analyze_expression(self):
+        m = pe.ConcreteModel()
+        m.w = ro.UncParam(range(2), nominal=(1, 2))
+        m.x = pe.Var(range(2), initialize=2)
+        m.z = pe.Var(initialize=5)
+        expr = 2*(m.x[0]*m.w[0] - m.w[1]*m.x[1]) + m.w[0] + m.z/4 - 1
+        repn, parents = analyze_expression(expr)
+        self.assertEqual(parents[ro.UncParam], [m.w])
+        self.assertEqual(parents[ro.AdjustableVar], [])
+        self.assertTrue(repn.is_linear())
+        coefs = {id(v): pe.value(c)
+                 for v, c in zip(repn.linear_vars, repn.linear_coefs)}
+        self.assertEqual(coefs, {id(m.w[0]): 5, id(m.w[1]): -4})
+        self.assertEqual(pe.value(repn.constant), 0.25)
+        # Nonlinear in UncParam: falls back to generate_repn_param
+        repn, parents = analyze_expression(m.x[0]*m.w[0]**2 + m.z)
+        self.assertEqual(parents[ro.UncParam], [m.w])
+        self.assertTrue(repn.is_quadratic())
+
+    def test_analyze_component_named_expression(self):
+        m = pe.ConcreteModel()
+        m.w = ro.UncParam(range(2), nominal=(1, 2))
+        m.x = pe.Var(range(2))
+        m.e = pe.Expression(expr=m.x[0])
+        m.c = pe.Constraint(expr=m.e <= 1)
+        self.assertFalse(component_is_uncertain(m.c))
+        # Changing the named expression invalidates the cached analysis
+        m.e.set_value(m.w[0]*m.x[0])
+        self.assertTrue(component_is_uncertain(m.c))
+        repn, _ = analyze_component(m.c)
+        self.assertEqual([id(v) for v in repn.linear_vars], [id(m.w[0])])
+
+    def test_analyze_linear_expression_adjustable(self):
+        m = pe.ConcreteModel()
+        m.w = ro.UncParam(range(2), nominal=(1, 2))
+        m.y = ro.AdjustableVar(range(2), uncparams=[m.w])
+        m.x = pe.Var(range(2))
+        expr = pe.quicksum([2*m.y[0], 3*m.w[0], m.x[0]])
+        self.assertIsInstance(expr, LinearExpression)
+        m.c = pe.Constraint(expr=expr <= 1)
+        # UncParams after the first AdjustableVar are still recorded
+        self.assertTrue(component_is_uncertain(m.c))
+        self.assertTrue(component_is_adjustable(m.c))
+        self.assertEqual(component_parents(m.c)[ro.UncParam], [m.w])
+
+    def test_analyze_component_cached(self):
+        m = pe.ConcreteModel()
+        m.w = ro.UncParam(range(2), nominal=(1, 2))
+        m.x = pe.Var(range(2))
+        m.c = pe.Constraint(expr=m.x[0]*m.w[0] + m.x[1]*m.w[1] <= 1)
+        repn, parents = analyze_component(m.c)
+        self.assertIs(analyze_component(m.c)[0], repn)
+        self.assertIs(component_parents(m.c), parents)
+        self.assertEqual(set(id(c) for c in repn.linear_coefs),
+                         set(id(m.x[i]) for i in m.x))
@@ -30,6 +30,11 @@ def train_warped_gp(N, noise, warping_terms=3):
     return gp, norm
 
 
+def evaluate(a):
+    """ Evaluate an array of Pyomo expressions. """
+    return np.array([[pe.value(e) for e in row] for row in np.atleast_2d(a)])
+
+
 class TestWarpedGP(unittest.TestCase):
     def test_simple_gp(self):
         m = pe.ConcreteModel()
@@ -169,3 +174,150 @@ class TestWarpedGP(unittest.TestCase):
 
         self.assertEqual(len(repn.nonlinear_vars), 0)
         self.assertEqual(len(m.c_counterpart.stationarity), 2)
+
+    def test_inducing_points(self):
+        m = pe.ConcreteModel()
+        gp, norm = train_warped_gp(20, 0.05)
+
+        m.x = pe.Var(range(2))
+        m.z = pe.Var(range(2))
+
+        m.uncset = ro.uncset.WarpedGPSet(gp, m.z, 0.95, inducing=5)
+        m.w = ro.UncParam(range(2), uncset=m.uncset)
+        self.assertTrue(m.uncset.is_low_rank())
+
+        m.c = pe.Constraint(expr=m.x[0]*m.w[0] + m.x[1]*m.w[1] <= 1)
+
+        t = pe.TransformationFactory('romodel.warpedgp')
+        t.apply_to(m)
+
+        self.assertTrue(hasattr(m.c_counterpart, 'dual'))
+        self.assertEqual(len(m.c_counterpart.stationarity), 2)
+        mu, K, C = m.uncset.predict_latent_factor([0, 1])
+        self.assertEqual(K.shape, (2, 5))
+        self.assertEqual(C.shape, (5, 5))
+
+    def test_inducing_points_exact(self):
+        # With all training inputs as inducing inputs the low-rank posterior
+        # at the training inputs is exact
+        x, y = generate_data(10, 0.05)
+        kernel = GPy.kern.RBF(input_dim=1, variance=1., lengthscale=1.)
+        gp = GPy.models.GPRegression(x, y, kernel=kernel)
+        m = pe.ConcreteModel()
+        m.z = pe.Var(range(2))
+        m.uncset = ro.uncset.GPSet(gp, m.z, 0.95, inducing=x)
+        for i in m.z:
+            m.z[i].value = x[i, 0]
+        mu, K, C = m.uncset.predict_factor([0, 1])
+        mu_exact, Sig = m.uncset.predict([0, 1])
+        K = evaluate(K)
+        self.assertTrue(np.allclose(evaluate(mu), evaluate(mu_exact)))
+        self.assertTrue(np.allclose(K.dot(C).dot(C.T).dot(K.T),
+                                    evaluate(Sig), atol=1e-6))
+
+    def test_inducing_points_normalizer(self):
+        x, y = generate_data(10, 0.05)
+        kernel = GPy.kern.RBF(input_dim=1, variance=1., lengthscale=1.)
+        gp = GPy.models.GPRegression(x, 3*y + 2, kernel=kernel,
+                                     mean_function=GPy.mappings.Linear(1, 1),
+                                     normalizer=True)
+        gp.mean_function.A[:] = 0.5
+        m = pe.ConcreteModel()
+        m.z = pe.Var(range(2))
+        m.uncset = ro.uncset.GPSet(gp, m.z, 0.95, inducing=x)
+        for i in m.z:
+            m.z[i].value = x[i, 0]
+        mu, K, C = m.uncset.predict_factor([0, 1])
+        K = evaluate(K)
+        mu_gpy, Sig_gpy = gp.predict_noiseless(x[:2], full_cov=True)
+        self.assertTrue(np.allclose(evaluate(mu), mu_gpy))
+        self.assertTrue(np.allclose(K.dot(C).dot(C.T).dot(K.T), Sig_gpy,
+                                    atol=1e-6))
+
+    def test_inducing_points_ill_conditioned(self):
+        # Low-noise GP with all training inputs as inducing inputs, the
+        # Cholesky factorization needs more than the minimal jitter
+        x, y = generate_data(30, 0.)
+        kernel = GPy.kern.RBF(input_dim=1, variance=1., lengthscale=1.)
+        gp = GPy.models.GPRegression(x, y, kernel=kernel)
+        gp.optimize()
+        gp.likelihood.variance = 1e-10
+        m = pe.ConcreteModel()
+        m.z = pe.Var(range(2))
+        m.uncset = ro.uncset.GPSet(gp, m.z, 0.95, inducing=30)
+        for i in m.z:
+            m.z[i].value = x[i, 0]
+        mu, K, C = m.uncset.predict_factor([0, 1])
+        self.assertEqual(C.shape, (30, 30))
+        self.assertTrue(np.all(np.isfinite(C)))
+        mu_gpy, _ = gp.predict_noiseless(x[:2])
+        self.assertTrue(np.allclose(evaluate(mu).reshape(-1, 1), mu_gpy,
+                                    atol=5e-2))
+
+    def test_gp_inducing_points(self):
+        x, y = generate_data(20, 0.05)
+        kernel = GPy.kern.RBF(input_dim=1, variance=1., lengthscale=1.)
+        gp = GPy.models.GPRegression(x, y, kernel=kernel)
+        m = pe.ConcreteModel()
+        m.x = pe.Var(range(2))
+        m.z = pe.Var(range(2))
+        m.uncset = ro.uncset.GPSet(gp, m.z, 0.95, inducing=5)
+        m.w = ro.UncParam(range(2), uncset=m.uncset)
+        self.assertTrue(m.uncset.is_low_rank())
+        m.c = pe.Constraint(expr=m.x[0]*m.w[0] + m.x[1]*m.w[1] <= 1)
+        pe.TransformationFactory('romodel.gp').apply_to(m)
+        self.assertTrue(hasattr(m.c_counterpart, 'upper'))
+        mu, K, C = m.uncset.predict_factor([0, 1])
+        self.assertEqual(K.shape, (2, 5))
+        self.assertEqual(C.shape, (5, 5))
+
+    def test_gp_predict_memoized(self):
+        x, y = generate_data(20, 0.05)
+        kernel = GPy.kern.RBF(input_dim=1, variance=1., lengthscale=1.)
+        gp = GPy.models.GPRegression(x, y, kernel=kernel)
+        m = pe.ConcreteModel()
+        m.x = pe.Var(range(2))
+        m.z = pe.Var(range(2))
+        m.uncset = ro.uncset.GPSet(gp, m.z, 0.95)
+        m.w = ro.UncParam(range(2), uncset=m.uncset)
+        m.c = pe.Constraint(expr=m.x[0]*m.w[0] + m.x[1]*m.w[1] <= 1)
+        m.d = pe.Constraint(expr=2*m.x[0]*m.w[0] + m.w[1] <= 3)
+        pe.TransformationFactory('romodel.gp').apply_to(m)
+        # Both constraints use the posterior of the same index set
+        self.assertEqual(list(m.uncset._predictions), [(0, 1)])
+        mu, Sig = m.uncset.predict([0, 1])
+        self.assertIs(m.uncset.predict([0, 1])[0], mu)
+        self.assertIs(m.uncset.predict([0, 1])[1], Sig)
+
+    def test_elementwise_warping_derivative(self):
+        # The elementwise scaling with dH^-1 agrees with the dense
+        # formulation x^T diag(dH^-1) Sig diag(dH^-1) x
+        from rogp.util.numpy import _pyomo_to_np
+        m = pe.ConcreteModel()
+        gp, norm = train_warped_gp(20, 0.05)
+        m.x = pe.Var(range(2), initialize={0: 0.3, 1: 1.3})
+        m.z = pe.Var(range(2), initialize={0: 0.2, 1: 0.6})
+        m.uncset = ro.uncset.WarpedGPSet(gp, m.z, 0.95)
+        m.w = ro.UncParam(range(2), uncset=m.uncset)
+        m.c = pe.Constraint(expr=m.x[0]*m.w[0] + m.x[1]*m.w[1] <= 1)
+        pe.TransformationFactory('romodel.warpedgp').apply_to(m)
+        b = m.c_counterpart
+        b.y[0].value = -0.1
+        b.y[1].value = 0.4
+        b.u.value = -0.7
+
+        y = _pyomo_to_np(b.y, ind=[0, 1])
+        hz = evaluate(m.uncset.gp.warp(y))
+        D = np.diag(1/evaluate(m.uncset.gp.warp_deriv(y))[:, 0])
+        mu, Sig = m.uncset.predict_latent([0, 1])
+        mu, Sig = evaluate(mu), evaluate(Sig)
+        x = np.array([[0.3], [1.3]])
+        Sw = Sig.dot(D).dot(x)
+        rhs = x.T.dot(D).dot(Sig).dot(D).dot(x)[0, 0]
+        u = b.u.value
+        for k in range(2):
+            self.assertAlmostEqual(pe.value(b.stationarity[k].body),
+                                   Sw[k, 0] + 2*u*(hz[k, 0] - mu[k, 0]))
+        # dual: 4 u^2 F == rhs
+        self.assertAlmostEqual(4*u**2*m.uncset.F - pe.value(b.dual.body),
+                               rhs)
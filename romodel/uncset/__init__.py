@@ -1,4 +1,4 @@
 from .base import UncSet
-from .ellipsoidal import EllipsoidalSet
+from .ellipsoidal import EllipsoidalSet, factorize_cov, invert_factor
 from .polyhedral import PolyhedralSet
 from .gp import WarpedGPSet, GPSet
@@ -1,5 +1,7 @@
+import numpy as np
 from pyomo.core import ScalarBlock, ModelComponentFactory, Component
-from pyomo.core import Constraint
+from pyomo.core import Constraint, value
+from pyomo.core.expr.visitor import identify_mutable_parameters
 from romodel.uncparam import UncParam
 
 
@@ -36,6 +38,9 @@ class UncSet(ScalarBlock):
             self._param = _param
 
         self._lib = False
+        self._cache = {}
+        # Mutable Params of each constraint, keyed on its expressions
+        self._mutable = {}
 
     def is_empty(self):
         if self._lib:
@@ -47,6 +52,45 @@ class UncSet(ScalarBlock):
     def is_lib(self):
         return self._lib
 
+    def _signature(self):
+        """
+        Identify the current state of the set's constraints. Changes when
+        constraints are added, removed, deactivated or given a new expression,
+        or when the value of a mutable Param in a constraint changes.
+        """
+        return tuple(self._constraint_signature(c)
+                     for c in self.component_data_objects(Constraint,
+                                                          active=True))
+
+    def _constraint_signature(self, c):
+        key = (id(c), id(c.body), id(c.lower), id(c.upper))
+        entry = self._mutable.get(id(c))
+        if entry is None or entry[0] != key:
+            params = []
+            for e in (c.body, c.lower, c.upper):
+                if e is not None:
+                    params.extend(identify_mutable_parameters(e))
+            entry = (key, params)
+            self._mutable[id(c)] = entry
+        return key + tuple(value(p) for p in entry[1])
+
+    def get_cached(self, key):
+        """
+        Return the value stored under `key` if the constraints of the set
+        have not changed since it was stored, otherwise None.
+        """
+        if key not in self._cache:
+            return None
+        signature, val = self._cache[key]
+        if signature != self._signature():
+            del self._cache[key]
+            return None
+        return val
+
+    def set_cached(self, key, val):
+        """ Store `val` under `key` for the current constraints of the set. """
+        self._cache[key] = (self._signature(), val)
+
     def get_uncertain_param(self):
         param = None
         for p in self.component_objects(UncParam, active=True):
@@ -55,6 +99,39 @@ class UncSet(ScalarBlock):
             else:
                 assert param is p
 
+    def worst_case(self, coef, sense):
+        """
+        Return the realization of the uncertain parameter which maximizes
+        (or minimizes) `coef^T * param` over the set as a numpy array, or
+        None if the set does not have a closed form solution.
+
+            coef: array of coefficients in the order of the parameter index
+            sense: pyomo.environ.maximize or pyomo.environ.minimize
+
+        """
+        return None
+
+    def worst_cases(self, coef, sense, k):
+        """
+        Return a list of up to `k` realizations with large (or small) value
+        of `coef^T * param`, starting with the worst case. Sets without a
+        closed form return an empty list.
+        """
+        point = self.worst_case(coef, sense)
+        if point is None:
+            return []
+        return [point]
+
+    def worst_case_batch(self, coef, sense):
+        """
+        Row-wise version of `worst_case` for a matrix of coefficients and a
+        list of senses. Returns a matrix of realizations or None.
+        """
+        points = [self.worst_case(c, s) for c, s in zip(coef, sense)]
+        if any(p is None for p in points):
+            return None
+        return np.array(points)
+
     def generate_cons_from_lib(self, param):
         name = self.__class__.__name__
         raise NotImplementedError(
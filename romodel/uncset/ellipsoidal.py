@@ -1,4 +1,6 @@
 import numpy as np
+import scipy.linalg
+from pyomo.environ import quicksum, minimize
 from romodel.uncset import UncSet
 
 
@@ -15,13 +17,104 @@ class EllipsoidalSet(UncSet):
         super().__init__(*args, **kwargs)
         self._lib = True
 
+    @property
+    def cov(self):
+        return self._cov
+
+    @cov.setter
+    def cov(self, cov):
+        # The factor and inverse are recomputed for the new covariance
+        self._cov = cov
+        self._factor = None
+        self._invcov = None
+
+    @property
+    def factor(self):
+        if self._factor is None:
+            self._factor = factorize_cov(self._cov)
+        return self._factor
+
+    @property
+    def invcov(self):
+        if self._invcov is None:
+            self._invcov = invert_factor(self.factor)
+        return self._invcov
+
+    def worst_case(self, coef, sense):
+        '''
+        Maximizer of coef^T * param over the ellipsoid:
+            mu + sqrt(rhs) * cov * coef / ||L^T * coef||
+        '''
+        coef = np.asarray(coef, dtype=float)
+        mean = np.asarray(self.mean, dtype=float)
+        aux = self.factor.T.dot(coef)
+        norm = np.linalg.norm(aux)
+        if norm == 0:
+            return mean
+        step = np.sqrt(self.rhs)*self.factor.dot(aux)/norm
+        if sense is minimize:
+            return mean - step
+        return mean + step
+
+    def worst_case_batch(self, coef, sense):
+        coef = np.asarray(coef, dtype=float)
+        mean = np.asarray(self.mean, dtype=float)
+        aux = coef.dot(self.factor)
+        norm = np.linalg.norm(aux, axis=1)
+        # Zero coefficient vectors are maximized by the mean
+        scale = np.divide(np.sqrt(self.rhs), norm,
+                          out=np.zeros_like(norm), where=norm != 0)
+        scale[[s is minimize for s in sense]] *= -1
+        return mean + (scale[:, None]*aux).dot(self.factor.T)
+
     def generate_cons_from_lib(self, param):
         assert len(param) == len(self.mean)
-        expr = 0
-        invcov = np.linalg.inv(self.cov)
-        for i, ind_i in enumerate(param):
-            for j, ind_j in enumerate(param):
-                expr += ((param[ind_i] - self.mean[i])
-                         * invcov[i, j]
-                         * (param[ind_j] - self.mean[j]))
+        invcov = self.invcov
+        diff = [param[ind] - self.mean[i] for i, ind in enumerate(param)]
+        n = len(diff)
+        expr = quicksum(diff[i]*invcov[i, j]*diff[j]
+                        for i in range(n)
+                        for j in range(n)
+                        if invcov[i, j] != 0)
         yield None, expr, self.rhs
+        # A rank deficient covariance defines a degenerate ellipsoid
+        # mu + L * z, ||z||^2 <= rhs: param - mu is orthogonal to the null
+        # space of L^T
+        null = scipy.linalg.null_space(self.factor.T)
+        for k in range(null.shape[1]):
+            yield 0, quicksum(null[i, k]*diff[i] for i in range(n)
+                              if abs(null[i, k]) > 1e-12), 0
+
+
+def factorize_cov(cov, tol=1e-10):
+    '''
+    Return a factor L of the covariance matrix such that cov = L * L^T.
+
+    Uses the Cholesky factorization if `cov` is positive definite. Otherwise
+    L is computed from the eigendecomposition and only contains the columns
+    of eigenvalues larger than `tol` (relative to the largest eigenvalue),
+    i.e. L has shape n x rank(cov).
+    '''
+    cov = np.asarray(cov, dtype=float)
+    try:
+        return np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        eig, vec = np.linalg.eigh(cov)
+        keep = eig > tol*max(eig.max(), 0)
+        return vec[:, keep]*np.sqrt(eig[keep])
+
+
+def invert_factor(L):
+    '''
+    Return the inverse of cov = L * L^T from its factor L. If L is a square
+    lower triangular (Cholesky) factor this only requires triangular solves.
+    For a rank deficient factor the pseudo-inverse is returned, which only
+    describes the ellipsoid together with the constraint that param - mu
+    lies in the range of L (see EllipsoidalSet.generate_cons_from_lib).
+    '''
+    n, r = L.shape
+    if n == r and not np.any(np.triu(L, 1)):
+        Linv = scipy.linalg.solve_triangular(L, np.eye(n), lower=True)
+    else:
+        Linv = np.linalg.pinv(L)
+    return Linv.T.dot(Linv)
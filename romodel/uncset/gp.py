@@ -1,12 +1,116 @@
 from romodel.uncset import UncSet
 from pyomo.environ import Var
+import numpy as np
+
+
+def _gp_inputs(var, index_set):
+    """ Return the GP inputs for the UncParam indices `index_set`. """
+    from rogp.util.numpy import _pyomo_to_np, _to_np_obj_array
+    if type(var) is dict:
+        return _to_np_obj_array([var[i] for i in index_set])
+    return _pyomo_to_np(var[0], ind=index_set)
+
+
+def _inducing_posterior(gp, inducing, jitter=1e-8, max_tries=8):
+    """
+    Subset-of-regressors (Nystrom) approximation of the posterior of the
+    GPy model `gp` based on inducing inputs. The mean function and the
+    output normalizer of `gp` are taken into account.
+
+    Args:
+        gp: GPy model
+        inducing: Number of inducing points or an array of inducing inputs.
+            A number m selects m training inputs evenly spaced by their
+            position in the training set (not by input location), so the
+            training data should be sorted if the points are meant to
+            cover the input space.
+        jitter: Initial jitter added to the diagonal, relative to the mean
+            diagonal entry. It is increased tenfold up to `max_tries` times
+            until the Cholesky factorization succeeds, after which an
+            eigendecomposition with clipped eigenvalues is used instead.
+    Returns:
+        A tuple (Z, a, C, mean) such that for inputs z the posterior mean is
+        K(z, Z) a + mean(z) and the posterior covariance is
+        (K(z, Z) C)(K(z, Z) C)^T.
+    """
+    from scipy.linalg import cholesky, solve_triangular, eigh, LinAlgError
+    X = np.asarray(gp.X)
+    if np.isscalar(inducing):
+        idx = np.linspace(0, X.shape[0] - 1, int(inducing)).astype(int)
+        Z = X[np.unique(idx)]
+    else:
+        Z = np.atleast_2d(np.asarray(inducing, dtype=float))
+    Y = np.asarray(gp.Y_normalized)
+    if gp.mean_function is not None:
+        Y = Y - gp.mean_function.f(X)
+    s2 = float(gp.likelihood.variance)
+    Kuu = gp.kern.K(Z)
+    Kuf = gp.kern.K(Z, X)
+    A = Kuu + Kuf.dot(Kuf.T)/s2
+    eye = np.eye(Z.shape[0])
+    # A^-1 = C C^T
+    C = None
+    diag = np.trace(A)/Z.shape[0]
+    for k in range(max_tries):
+        try:
+            R = cholesky(A + jitter*10**k*diag*eye, lower=True)
+        except LinAlgError:
+            continue
+        C = solve_triangular(R, eye, lower=True).T
+        break
+    if C is None:
+        w, V = eigh(A)
+        w = np.maximum(w, jitter*10**max_tries*diag)
+        C = V/np.sqrt(w)
+    a = C.dot(C.T.dot(Kuf.dot(Y)))/s2
+    # Undo the (affine) output normalization: y = scale*y_normalized + offset
+    scale, offset = 1., 0.
+    if gp.normalizer is not None:
+        scale = float(np.sqrt(np.ravel(gp.normalizer.inverse_variance(
+            np.ones((1, 1)))))[0])
+        offset = float(np.ravel(gp.normalizer.inverse_mean(
+            np.zeros((1, 1))))[0])
+
+    def mean(z):
+        if gp.mean_function is None:
+            return offset
+        return scale*gp.mean_function.f(z) + offset
+    return Z, scale*a, scale*C, mean
+
+
+def _predict_factor(uncset, index_set):
+    """
+    Return the (symbolic) posterior mean mu and the factors K and C of the
+    low-rank posterior covariance K C C^T K^T of the GP of `uncset` at the
+    inputs corresponding to the UncParam indices `index_set`. Memoized in
+    `uncset._predictions`.
+    """
+    key = ('factor', tuple(index_set))
+    if key not in uncset._predictions:
+        Z, a, C, mean = uncset._inducing
+        z = _gp_inputs(uncset.var, index_set)
+        K = uncset.gp.kern.K(z, Z)
+        uncset._predictions[key] = (np.matmul(K, a) + mean(z), K, C)
+    return uncset._predictions[key]
 
 
 class WarpedGPSet(UncSet):
-    def __init__(self, gp, var, alpha, tanh=False, *args, **kwargs):
+    '''
+    Warped Gaussian process uncertainty set of confidence level `alpha` for the
+    outputs of the GPy model `gp` at the inputs `var`. If `inducing` is
+    given, the posterior is approximated with inducing points: either an
+    array of inducing inputs or their number m, in which case m training
+    inputs evenly spaced by their index in the training set (not by input
+    location) are used.
+    '''
+    def __init__(self, gp, var, alpha, tanh=False, inducing=None,
+                 *args, **kwargs):
         import scipy as sp
         import rogp
         self.gp = rogp.from_gpy(gp, tanh=tanh)
+        self._inducing = None
+        if inducing is not None:
+            self._inducing = _inducing_posterior(gp, inducing)
         if type(var) is dict:
             self.var = var
         else:
@@ -16,6 +120,8 @@ class WarpedGPSet(UncSet):
             self.var = [var]
         self.alpha = alpha
         self.F = sp.stats.chi2.ppf(alpha, len(self.var))
+        # Symbolic latent posterior mean and covariance, memoized by index set
+        self._predictions = {}
         super().__init__(*args, **kwargs)
         self._lib = True
 
@@ -25,12 +131,49 @@ class WarpedGPSet(UncSet):
     def is_ellipsoidal(self):
         return False
 
+    def is_low_rank(self):
+        """ True if the posterior is approximated with inducing points. """
+        return self._inducing is not None
+
+    def predict_latent_factor(self, index_set):
+        """
+        Return the (symbolic) latent posterior mean mu and the factors K and
+        C of the low-rank latent posterior covariance K C C^T K^T, where K is
+        the kernel between the inputs and the m inducing points and C a
+        numeric m x m matrix. Memoized by index set.
+        """
+        return _predict_factor(self, index_set)
+
+    def predict_latent(self, index_set):
+        """
+        Return the (symbolic) latent posterior mean and covariance of the GP
+        at the inputs corresponding to the UncParam indices `index_set`,
+        built once per distinct index set.
+        """
+        key = tuple(index_set)
+        if key not in self._predictions:
+            z = _gp_inputs(self.var, index_set)
+            self._predictions[key] = (self.gp.predict_mu_latent(z),
+                                      self.gp.predict_cov_latent(z))
+        return self._predictions[key]
+
 
 class GPSet(UncSet):
-    def __init__(self, gp, var, alpha, *args, **kwargs):
+    '''
+    Gaussian process uncertainty set of confidence level `alpha` for the
+    outputs of the GPy model `gp` at the inputs `var`. If `inducing` is
+    given, the posterior is approximated with inducing points: either an
+    array of inducing inputs or their number m, in which case m training
+    inputs evenly spaced by their index in the training set (not by input
+    location) are used.
+    '''
+    def __init__(self, gp, var, alpha, inducing=None, *args, **kwargs):
         import scipy as sp
         import rogp
         self.gp = rogp.from_gpy(gp)
+        self._inducing = None
+        if inducing is not None:
+            self._inducing = _inducing_posterior(gp, inducing)
         if type(var) is dict:
             self.var = var
         else:
@@ -40,6 +183,8 @@ class GPSet(UncSet):
             self.var = [var]
         self.alpha = alpha
         self.F = sp.stats.norm.ppf(alpha)
+        # Symbolic posterior mean and covariance, memoized by index set
+        self._predictions = {}
         super().__init__(*args, **kwargs)
         self._lib = True
 
@@ -48,3 +193,31 @@ class GPSet(UncSet):
 
     def is_ellipsoidal(self):
         return False
+
+    def is_low_rank(self):
+        """ True if the posterior is approximated with inducing points. """
+        return self._inducing is not None
+
+    def predict_factor(self, index_set):
+        """
+        Return the (symbolic) posterior mean mu and the factors K and C of
+        the low-rank posterior covariance K C C^T K^T, where K is the kernel
+        between the inputs and the m inducing points and C a numeric m x m
+        matrix. Memoized by index set.
+        """
+        return _predict_factor(self, index_set)
+
+    def predict(self, index_set):
+        """
+        Return the (symbolic) posterior mean and covariance of the GP at the
+        inputs corresponding to the UncParam indices `index_set`.
+
+        The posterior is built once per distinct index set and shared by all
+        constraints which use this set with the same UncParam indices.
+        """
+        key = tuple(index_set)
+        if key not in self._predictions:
+            z = _gp_inputs(self.var, index_set)
+            self._predictions[key] = (self.gp.predict_mu(z),
+                                      self.gp.predict_cov(z))
+        return self._predictions[key]
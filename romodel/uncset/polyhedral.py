@@ -1,21 +1,152 @@
-from pyomo.core import quicksum
+from pyomo.core import quicksum, minimize
 from romodel.uncset import UncSet
+import numpy as np
+import scipy.sparse
 
 
 class PolyhedralSet(UncSet):
     '''
     Defines a polyhedral uncertainty set of shape:
         P * param <= b
+
+    The matrix P is stored as a sparse `scipy.sparse.csr_matrix`.
     '''
     def __init__(self, mat, rhs, *args, **kwargs):
-        self.mat = mat
+        self.mat = scipy.sparse.csr_matrix(mat)
         self.rhs = rhs
+        self._box = None
         super().__init__(*args, **kwargs)
         self._lib = True
 
+    @property
+    def box(self):
+        '''
+        Lower and upper bounds (lb, ub) if every row of P contains a single
+        nonzero and every parameter is bounded, i.e. the set is a box.
+        Otherwise None.
+        '''
+        if self._box is None:
+            self._box = self._extract_box()
+        return self._box if self._box is not False else None
+
+    def _extract_box(self):
+        mat = self.mat
+        lb = np.full(mat.shape[1], -np.inf)
+        ub = np.full(mat.shape[1], np.inf)
+        for i in range(mat.shape[0]):
+            start, stop = mat.indptr[i], mat.indptr[i + 1]
+            if stop - start > 1:
+                return False
+            if start == stop:
+                continue
+            j, a = mat.indices[start], mat.data[start]
+            if a > 0:
+                ub[j] = min(ub[j], self.rhs[i]/a)
+            else:
+                lb[j] = max(lb[j], self.rhs[i]/a)
+        if not (np.all(np.isfinite(lb)) and np.all(np.isfinite(ub))):
+            return False
+        return lb, ub
+
+    def worst_case(self, coef, sense):
+        '''
+        Sign based maximizer of coef^T * param if the set is a box.
+        '''
+        box = self.box
+        if box is None:
+            return None
+        lb, ub = box
+        coef = np.asarray(coef, dtype=float)
+        if sense is minimize:
+            coef = -coef
+        return np.where(coef > 0, ub, lb)
+
+    def worst_cases(self, coef, sense, k):
+        '''
+        Worst-case vertex of a box followed by the adjacent vertices with the
+        smallest loss in objective.
+        '''
+        point = self.worst_case(coef, sense)
+        if point is None:
+            return []
+        lb, ub = self.box
+        loss = np.abs(np.asarray(coef, dtype=float))*(ub - lb)
+        points = [point]
+        for j in np.argsort(loss)[:k - 1]:
+            vertex = point.copy()
+            vertex[j] = lb[j] if point[j] == ub[j] else ub[j]
+            points.append(vertex)
+        return points
+
+    def worst_case_batch(self, coef, sense):
+        box = self.box
+        if box is None:
+            return None
+        lb, ub = box
+        coef = np.array(coef, dtype=float)
+        coef[[s is minimize for s in sense]] *= -1
+        return np.where(coef > 0, ub, lb)
+
     def generate_cons_from_lib(self, param):
-        for i, row in enumerate(self.mat):
+        index = list(param)
+        mat = self.mat
+        for i in range(mat.shape[0]):
+            start, stop = mat.indptr[i], mat.indptr[i + 1]
+            # Skip empty rows, 0 <= rhs is either always or never satisfied
+            if start == stop:
+                if self.rhs[i] < 0:
+                    raise RuntimeError(
+                            "Uncertainty set {} is empty: row {} of the "
+                            "constraint matrix is zero but its right-hand "
+                            "side is negative.".format(self.name, i))
+                continue
             yield (None,
-                   quicksum(row[j]*param[ind]
-                            for j, ind in enumerate(param)),
+                   quicksum(float(mat.data[k])*param[index[mat.indices[k]]]
+                            for k in range(start, stop)),
                    self.rhs[i])
+
+
+def adjacent_vertices(mat, rhs, point, coef, sense, k, tol=1e-6):
+    '''
+    Return up to `k` vertices of the polyhedron mat * param <= rhs which are
+    adjacent to the vertex `point`, ordered by the loss in coef^T * param
+    when moving along the connecting edge (a gain if `sense` is minimize).
+    Returns an empty list if `point` is not a vertex.
+    '''
+    if scipy.sparse.issparse(mat):
+        mat = mat.toarray()
+    mat = np.asarray(mat, dtype=float)
+    rhs = np.asarray(rhs, dtype=float)
+    point = np.asarray(point, dtype=float)
+    coef = np.asarray(coef, dtype=float)
+    if sense is minimize:
+        coef = -coef
+    n = len(point)
+    if mat.shape[1] != n:
+        return []
+    slack = rhs - mat.dot(point)
+    active = np.flatnonzero(slack <= tol*(1 + np.abs(rhs)))
+    # Choose n linearly independent active rows as basis of the vertex
+    basis = []
+    for i in active:
+        if np.linalg.matrix_rank(mat[basis + [i]]) > len(basis):
+            basis.append(i)
+        if len(basis) == n:
+            break
+    if len(basis) < n:
+        return []
+    inv = np.linalg.inv(mat[basis])
+    vertices = []
+    for j in range(n):
+        # Edge leaving row basis[j] while the other rows stay active
+        d = -inv[:, j]
+        step = mat.dot(d)
+        blocking = step > tol
+        if not blocking.any():
+            continue
+        t = np.min(np.maximum(slack[blocking], 0)/step[blocking])
+        if t <= tol:
+            continue
+        vertices.append((-coef.dot(d)*t, point + t*d))
+    vertices.sort(key=lambda v: v[0])
+    return [v for _, v in vertices[:k]]
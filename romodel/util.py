@@ -1,10 +1,14 @@
-from romodel.visitor import identify_parent_components
+from pyomo.core import Var, Constraint
+from pyomo.core.expr.numvalue import native_numeric_types
+from pyomo.core.expr.visitor import identify_variables
+from pyomo.repn import generate_standard_repn
+from romodel.visitor import component_parents
 from romodel import UncParam
 from romodel.components import AdjustableVar
 
 
 def collect_uncparam(o):
-    param = list(identify_parent_components(o.expr, [UncParam]))
+    param = component_parents(o)[UncParam]
     assert len(param) == 1, (
             "Constraint {} should not contain more than one UncParam "
             "component".format(o.name))
@@ -12,8 +16,59 @@ def collect_uncparam(o):
 
 
 def collect_adjustable(o):
-    param = list(identify_parent_components(o.expr, [AdjustableVar]))
+    param = component_parents(o)[AdjustableVar]
     assert len(param) == 1, (
             "Constraint {} should not contain more than one AdjustableVar"
             "component".format(o.name))
     return param[0]
+
+
+def generate_repn_param(expr, quadratic=True):
+    """
+    Generate the standard representation of `expr` with respect to the
+    uncertain parameters it contains, treating all variables as coefficients.
+
+    Only the variables which appear in `expr` are (temporarily) fixed, so the
+    cost is linear in the size of the expression and independent of the size
+    of the model.
+    """
+    fixed = []
+    for v in identify_variables(expr, include_fixed=False):
+        if v.ctype is Var:
+            v.fix()
+            fixed.append(v)
+    try:
+        repn = generate_standard_repn(expr,
+                                      compute_values=False,
+                                      quadratic=quadratic)
+    finally:
+        for v in fixed:
+            v.unfix()
+    return repn
+
+
+def count_vars_and_cons(block):
+    """
+    Return the number of variables and constraints declared on `block` and
+    its sub-blocks.
+    """
+    nvars = sum(1 for _ in block.component_data_objects(Var))
+    ncons = sum(1 for _ in block.component_data_objects(Constraint))
+    return nvars, ncons
+
+
+def coef_pattern(coefs):
+    """
+    Return a hashable key for a vector of coefficients of the uncertain
+    parameters. Two vectors have the same key if all coefficients are equal
+    numbers, the same components, or expressions which print the same.
+    """
+    key = []
+    for c in coefs:
+        if c.__class__ in native_numeric_types:
+            key.append(('n', c))
+        elif c.is_expression_type():
+            key.append(('e', str(c)))
+        else:
+            key.append(('c', id(c)))
+    return tuple(key)
@@ -1,6 +1,15 @@
 from pyomo.core.expr.visitor import ExpressionValueVisitor
 from pyomo.core.expr.visitor import SimpleExpressionVisitor
-from pyomo.core.expr.numvalue import nonpyomo_leaf_types, native_types
+from pyomo.core.expr.numvalue import (nonpyomo_leaf_types,
+                                      native_types,
+                                      native_numeric_types)
+from pyomo.core.expr.numeric_expr import (SumExpressionBase,
+                                          NegationExpression,
+                                          ProductExpression,
+                                          DivisionExpression,
+                                          LinearExpression)
+from pyomo.core import quicksum
+from pyomo.repn import StandardRepn
 from romodel.uncparam import UncParam
 from romodel.components import AdjustableVar
 
@@ -105,3 +114,230 @@ def _expression_is_adjustable(node):
     """
     visitor = _IsAdjustableVisitor()
     return visitor.dfs_postorder_stack(node)
+
+
+def _is_zero(x):
+    return x.__class__ in native_numeric_types and x == 0
+
+
+def _is_one(x):
+    return x.__class__ in native_numeric_types and x == 1
+
+
+def _scale(val, factor):
+    """ Multiply a linear term (constant, coefs) by an UncParam-free factor.
+    """
+    const, coefs = val
+    if _is_one(factor):
+        return val
+    if _is_zero(factor):
+        return 0, {}
+    const = 0 if _is_zero(const) else const*factor
+    return const, {i: (p, factor if _is_one(c) else c*factor)
+                   for i, (p, c) in coefs.items()}
+
+
+class _UncParamRepnVisitor(ExpressionValueVisitor):
+    """
+    Decompose an expression into a constant term and coefficients of the
+    UncParam leaves in a single walk, collecting the UncParam and
+    AdjustableVar components on the way. Each node is mapped to a tuple
+    (constant, {id(param): (param, coef)}), or None if it is not linear in
+    the UncParams. Subtrees which do not contain an UncParam are kept as
+    they are. Named expressions are collected in `named` together with
+    their expression at the time of the walk.
+    """
+    def __init__(self):
+        self.parents = {UncParam: [], AdjustableVar: []}
+        self.named = []
+        self._seen = set()
+
+    def _add_parent(self, node):
+        parent = node.parent_component()
+        if id(parent) not in self._seen:
+            self._seen.add(id(parent))
+            self.parents[parent.ctype].append(parent)
+
+    def visit(self, node, values):
+        if node.is_named_expression_type():
+            self.named.append((node, node.expr))
+        if any(v is None for v in values):
+            return None
+        if all(not v[1] for v in values):
+            return node, {}
+        if node.is_named_expression_type():
+            return values[0]
+        if isinstance(node, SumExpressionBase):
+            const = [v[0] for v in values if not _is_zero(v[0])]
+            coefs = {}
+            for _, lin in values:
+                for i, (p, c) in lin.items():
+                    if i in coefs:
+                        coefs[i] = (p, coefs[i][1] + c)
+                    else:
+                        coefs[i] = (p, c)
+            if len(const) == 0:
+                const = 0
+            elif len(const) == 1:
+                const = const[0]
+            else:
+                const = quicksum(const, linear=False)
+            return const, coefs
+        if isinstance(node, NegationExpression):
+            return _scale(values[0], -1)
+        if isinstance(node, ProductExpression):
+            a, b = values
+            if a[1] and b[1]:
+                return None
+            if a[1]:
+                return _scale(a, b[0])
+            return _scale(b, a[0])
+        if isinstance(node, DivisionExpression):
+            num, den = values
+            if den[1]:
+                return None
+            return _scale(num, 1/den[0])
+        return None
+
+    def visiting_potential_leaf(self, node):
+        if (node.__class__ in nonpyomo_leaf_types
+                or not node.is_potentially_variable()):
+            return True, (node, {})
+
+        if not node.is_expression_type():
+            if node.ctype is UncParam:
+                self._add_parent(node)
+                return True, (0, {id(node): (node, 1)})
+            if node.ctype is AdjustableVar:
+                # AdjustableVars are not coefficients, leave them to
+                # generate_repn_param
+                self._add_parent(node)
+                return True, None
+            return True, (node, {})
+
+        if isinstance(node, LinearExpression):
+            vals = [(c, {}) if v.ctype is not UncParam
+                    else (0, {id(v): (v, c)})
+                    for v, c in zip(node.linear_vars, node.linear_coefs)]
+            for v in node.linear_vars:
+                if v.ctype in self.parents:
+                    self._add_parent(v)
+            if any(v.ctype is AdjustableVar for v in node.linear_vars):
+                return True, None
+            if all(not v[1] for v in vals):
+                return True, (node, {})
+            const = [c*v for (c, _), v in zip(vals, node.linear_vars)
+                     if c is not None and v.ctype is not UncParam]
+            coefs = {}
+            for _, lin in vals:
+                for i, (p, c) in lin.items():
+                    coefs[i] = (p, coefs[i][1] + c) if i in coefs else (p, c)
+            const = quicksum([node.constant] + const, linear=False)
+            return True, (const, coefs)
+
+        return False, None
+
+
+def _walk(expr):
+    visitor = _UncParamRepnVisitor()
+    res = visitor.dfs_postorder_stack(expr)
+    return res, visitor.parents, visitor.named
+
+
+def _build_repn(expr, res):
+    if res is None:
+        # Imported here to avoid a circular import
+        from romodel.util import generate_repn_param
+        return generate_repn_param(expr)
+    const, coefs = res
+    repn = StandardRepn()
+    repn.constant = const
+    nonzero = [(p, c) for p, c in coefs.values() if not _is_zero(c)]
+    repn.linear_vars = tuple(p for p, _ in nonzero)
+    repn.linear_coefs = tuple(c for _, c in nonzero)
+    return repn
+
+
+def analyze_expression(expr):
+    """
+    Analyze an expression with respect to the uncertain parameters it
+    contains.
+
+    In a single walk over the expression, the expression is split into a
+    constant term and coefficients of the UncParams (treating all variables
+    as coefficients) and the UncParam and AdjustableVar components are
+    collected. Only if the expression is not linear in the UncParams or
+    contains AdjustableVars, the representation is computed with
+    `generate_repn_param` instead.
+
+    Args:
+        expr: A Pyomo expression
+    Returns:
+        A tuple (repn, parents) where repn is a
+        `pyomo.repn.StandardRepn` and parents a dict mapping UncParam and
+        AdjustableVar to lists of the components of that type.
+    """
+    res, parents, _ = _walk(expr)
+    return _build_repn(expr, res), parents
+
+
+def _component_entry(cdata):
+    if hasattr(cdata, 'body'):
+        expr = cdata.body
+    else:
+        expr = cdata.expr
+    model = cdata.model()
+    cache = getattr(model, '_romodel_analysis', None)
+    if cache is None:
+        cache = model._romodel_analysis = {}
+    entry = cache.get(id(cdata))
+    # Named expressions in the body can change without the body itself
+    # being replaced
+    if (entry is None or entry[0] is not cdata or entry[1] is not expr
+            or any(e.expr is not sub for e, sub in entry[5])):
+        res, parents, named = _walk(expr)
+        # The representation is only built when it is first requested
+        entry = [cdata, expr, res, parents, None, named]
+        cache[id(cdata)] = entry
+    return entry
+
+
+def analyze_component(cdata):
+    """
+    Return `analyze_expression` of the body of a constraint or the
+    expression of an objective.
+
+    The result is cached on the model, keyed on the component data and the
+    identity of its expression and of the expressions of the named
+    Expressions it contains, so it is only recomputed if one of them is
+    replaced.
+
+    Args:
+        cdata: ConstraintData or ObjectiveData
+    Returns:
+        A tuple (repn, parents), see `analyze_expression`.
+    """
+    entry = _component_entry(cdata)
+    if entry[4] is None:
+        entry[4] = _build_repn(entry[1], entry[2])
+    return entry[4], entry[3]
+
+
+def component_parents(cdata):
+    """
+    Return the UncParam and AdjustableVar components which appear in the
+    body of a constraint or the expression of an objective, as a dict
+    mapping UncParam and AdjustableVar to lists of components. Shares the
+    cache of `analyze_component`.
+    """
+    return _component_entry(cdata)[3]
+
+
+def component_is_uncertain(cdata):
+    """ Return True if the component contains an UncParam. """
+    return len(component_parents(cdata)[UncParam]) > 0
+
+
+def component_is_adjustable(cdata):
+    """ Return True if the component contains an AdjustableVar. """
+    return len(component_parents(cdata)[AdjustableVar]) > 0